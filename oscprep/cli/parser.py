@@ -33,6 +33,16 @@ def setup_parser():
         help="workflow output directory.",
     )
 
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        type=str,
+        help=(
+            "directory of intermediate results reused across runs and"
+            " sessions of a subject. default=<scratch_dir>/oscprep_cache."
+        ),
+    )
+
     parser.add_argument(
         "--omp_nthreads",
         default=8,
@@ -40,6 +50,26 @@ def setup_parser():
         help="number of threads.",
     )
 
+    parser.add_argument(
+        "--nprocs",
+        default=None,
+        type=int,
+        help=(
+            "maximum number of processes run in parallel by the nipype"
+            " MultiProc plugin. default=number of CPUs."
+        ),
+    )
+
+    parser.add_argument(
+        "--mem_gb",
+        default=None,
+        type=float,
+        help=(
+            "memory (GB) available to the nipype MultiProc plugin."
+            " default=90%% of system memory."
+        ),
+    )
+
     """
     Config parameters
     """
@@ -77,6 +107,19 @@ def setup_parser():
         help="[mp2rage] denoise factor.",
     )
 
+    parser.add_argument(
+        "--mp2rage_denoise_sweep",
+        nargs="+",
+        type=int,
+        default=None,
+        metavar="FACTOR",
+        help=(
+            "[mp2rage] Also denoise with each of these factors (in the same"
+            " pass) and save them with background noise metrics in the"
+            " brainmask derivatives, to tune `--mp2rage_denoise_factor`."
+        ),
+    )
+
     parser.add_argument(
         "--mp2rage_synthstrip_no_csf_flag",
         action="store_true",
@@ -107,6 +150,17 @@ def setup_parser():
         ),
     )
 
+    parser.add_argument(
+        "--bold_ref_n_vols",
+        default=1,
+        type=int,
+        help=(
+            "[bold-ref] When a sbref image is not detected, use the median of"
+            " this many rigidly realigned volumes (from `--bold_ref_vol_idx`)"
+            " as the slab bold reference. default=1 (single volume)."
+        ),
+    )
+
     parser.add_argument(
         "--stc_off",
         action="store_true",
@@ -115,8 +169,51 @@ def setup_parser():
 
     parser.add_argument(
         "--bold_hmc_mppca",
-        action="store_true",
-        help=("[bold-hmc] Enable PCA-denoising on BOLD data prior to hmc."),
+        nargs="?",
+        const="global",
+        default=None,
+        choices=["global", "local"],
+        help=(
+            "[bold-hmc] Enable PCA-denoising on BOLD data prior to hmc."
+            " `global` keeps 10 components of a whole-image PCA, `local` runs"
+            " MP-PCA on overlapping patches with Marchenko-Pastur thresholding."
+            " default (flag only)=global."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_hmc_mppca_mask",
+        default=None,
+        choices=["intensity", "brainmask"],
+        help=(
+            "[bold-hmc] Restrict PCA-denoising to an intensity mask of the mean"
+            " BOLD image, or to the wholebrain brainmask transformed to the slab"
+            " (the slab reference image always uses an intensity mask)."
+            " Voxels outside of the mask are not denoised. default=no mask."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_hmc_mppca_mem_gb",
+        default=None,
+        type=float,
+        help=(
+            "[bold-hmc] Run global PCA-denoising out-of-core within this memory"
+            " budget (GB): BOLD data is memory-mapped and processed in voxel"
+            " chunks. default=loads BOLD data in memory."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_hmc_mppca_cache_gb",
+        default=None,
+        type=float,
+        help=(
+            "[bold-hmc] Cache PCA-denoised BOLD data in `--cache_dir`, within"
+            " this size (GB), to reuse it across nodes and runs denoising the"
+            " same series with the same parameters. Every lookup hashes the"
+            " input series. default=no cache."
+        ),
     )
 
     parser.add_argument(
@@ -125,6 +222,40 @@ def setup_parser():
         help=("[bold-hmc] Enable N4 bias field correction on BOLD data prior to hmc."),
     )
 
+    parser.add_argument(
+        "--bold_hmc_n4_mode",
+        default="volume",
+        choices=["volume", "reference", "mean"],
+        help=(
+            "[bold-hmc] `volume`: run N4 on every BOLD volume. `reference`/"
+            "`mean`: estimate the bias field once on the hmc reference or"
+            " the temporal mean and divide every volume by it."
+            " default=volume."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_hmc_engine",
+        default="mcflirt",
+        choices=["mcflirt", "native"],
+        help=(
+            "[bold-hmc] `mcflirt`: FSL MCFLIRT. `native`: in-process rigid"
+            " registration (least squares) estimating volumes in parallel"
+            " over `--omp_nthreads`, `--bold_hmc_cost_function` is ignored."
+            " default=mcflirt."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_hmc_save_mats_tar",
+        action="store_true",
+        help=(
+            "[bold-hmc] Also save hmc affines as a tarball of per-volume FSL"
+            " mat files (legacy derivative), next to the single"
+            " `desc-hmc_xfm.npz` store."
+        ),
+    )
+
     parser.add_argument(
         "--bold_hmc_cost_function",
         default="normcorr",
@@ -149,6 +280,18 @@ def setup_parser():
         ),
     )
 
+    parser.add_argument(
+        "--bold_hmc_lowpass_mask",
+        default=None,
+        choices=["intensity", "brainmask"],
+        help=(
+            "[bold-hmc] Restrict lowpass filtering to an intensity mask of the"
+            " mean BOLD image, or to the wholebrain brainmask transformed to"
+            " the slab. Voxels outside of the mask are not filtered."
+            " default=no mask."
+        ),
+    )
+
     parser.add_argument(
         "--fmapless",
         action="store_true",
@@ -223,4 +366,41 @@ def setup_parser():
         ),
     )
 
+    parser.add_argument(
+        "--bold_to_t1_engine",
+        default="native",
+        choices=["native", "fsl"],
+        help=(
+            "[registration] Engine used to apply hmc and bold-to-t1 transforms"
+            " to slab bold data. `fsl` runs ConvertWarp and ApplyWarp on every"
+            " volume. default=native."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_fused_resampling",
+        action="store_true",
+        help=(
+            "[registration] Resample raw slab bold data to T1w and"
+            " MNI152NLin6Asym space in one pass, combining slice-timing,"
+            " hmc, sdc and registration transforms into a single interpolation."
+            " Both spaces are resampled with trilinear interpolation (the"
+            " MNI152NLin6Asym series is otherwise resampled from T1w space"
+            " with LanczosWindowedSinc); `--bold_std_resample_engine` is"
+            " ignored."
+        ),
+    )
+
+    parser.add_argument(
+        "--bold_std_resample_engine",
+        default="ants",
+        choices=["ants", "sparse"],
+        help=(
+            "[registration] Engine used to resample T1w-space slab bold data to"
+            " MNI152NLin6Asym space. `sparse` builds a trilinear resampling"
+            " operator once per transform (cached in `--cache_dir`) and applies"
+            " it to the whole series. default=ants."
+        ),
+    )
+
     return parser
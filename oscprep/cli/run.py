@@ -27,6 +27,7 @@ def run():
     # utils
     from oscprep.cli.parser import setup_parser
     from oscprep.utils.data_grabber import bids_reader
+    from oscprep.utils.resources import estimate_bold_mem_gb, set_workflow_resources
 
     # output workflows
     from oscprep.workflows.derivatives.source_files import (
@@ -73,6 +74,7 @@ def run():
     )
     from oscprep.workflows.registration.apply import (
         init_apply_bold_to_anat_wf,
+        init_apply_bold_fused_wf,
     )
     from oscprep.workflows.registration.utils import (
         init_fsl_merge_transforms_wf,
@@ -94,20 +96,41 @@ def run():
 
     # Other config params
     # nipype param
-    OMP_NTHREADS = args.omp_nthreads
+    NPROCS = args.nprocs if args.nprocs is not None else os.cpu_count()
+    MEM_GB = args.mem_gb
+    OMP_NTHREADS = min(args.omp_nthreads, NPROCS)
+    PLUGIN_SETTINGS = {
+        "plugin": "MultiProc",
+        "plugin_args": {
+            "n_procs": NPROCS,
+            "raise_insufficient": False,
+        },
+    }
+    if MEM_GB is not None:
+        PLUGIN_SETTINGS["plugin_args"]["memory_gb"] = MEM_GB
     # mp2rage
     MP2RAGE_DENOISE_FACTOR = args.mp2rage_denoise_factor
+    MP2RAGE_DENOISE_SWEEP = args.mp2rage_denoise_sweep
     MP2RAGE_SYNTHSTRIP_NO_CSF = args.mp2rage_synthstrip_no_csf_flag
     MP2RAGE_SYNTHSTRIP_UPSAMPLE_RESOLUTION = args.mp2rage_synthstrip_res
     # mprage
     MPRAGE_SYNTHSTRIP_NO_CSF = args.mprage_synthstrip_no_csf_flag
     # bold
     BOLD_REF_VOL_IDX = args.bold_ref_vol_idx
+    BOLD_REF_N_VOLS = args.bold_ref_n_vols
     BOLD_STC_OFF = args.stc_off
-    BOLD_HMC_MPPCA = args.bold_hmc_mppca
+    BOLD_HMC_MPPCA = args.bold_hmc_mppca is not None
+    BOLD_HMC_MPPCA_METHOD = args.bold_hmc_mppca or "global"
+    BOLD_HMC_MPPCA_MASK = args.bold_hmc_mppca_mask
+    BOLD_HMC_MPPCA_MEM_GB = args.bold_hmc_mppca_mem_gb
+    BOLD_HMC_MPPCA_CACHE_GB = args.bold_hmc_mppca_cache_gb
     BOLD_HMC_N4 = args.bold_hmc_n4
+    BOLD_HMC_N4_MODE = args.bold_hmc_n4_mode
     BOLD_HMC_COST_FUNCTION = args.bold_hmc_cost_function
+    BOLD_HMC_ENGINE = args.bold_hmc_engine
+    BOLD_HMC_SAVE_MATS_TAR = args.bold_hmc_save_mats_tar
     BOLD_HMC_LOWPASS_THRESHOLD = args.bold_hmc_lowpass_threshold
+    BOLD_HMC_LOWPASS_MASK = args.bold_hmc_lowpass_mask
     # fmap
     use_fmaps = not args.fmapless
 
@@ -120,6 +143,19 @@ def run():
     FREESURFER_DIR = f"{DERIV_DIR}/freesurfer"
     BOLD_PREPROC_DIR = f"{DERIV_DIR}/bold_preproc"
     SDCFLOWS_DIR = f"{DERIV_DIR}/sdcflows"
+    # Caches shared by every run of a subject
+    CACHE_DIR = (
+        args.cache_dir
+        if args.cache_dir is not None
+        else f"{args.scratch_dir}/oscprep_cache"
+    )
+    RESAMPLING_CACHE_DIR = f"{CACHE_DIR}/sub-{SUBJECT_ID}/resampling"
+    PCA_CACHE_DIR = (
+        f"{CACHE_DIR}/sub-{SUBJECT_ID}/pca"
+        if BOLD_HMC_MPPCA_CACHE_GB is not None
+        else None
+    )
+    TEMPLATE_REG_DIR = f"{DERIV_DIR}/template_reg/sub-{SUBJECT_ID}"
     ## Make empty freesurfer directory
     for _dir in [DERIV_DIR, FREESURFER_DIR]:
         if not os.path.isdir(_dir):
@@ -350,7 +386,10 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
             )
 
             # mp2rage brainmask workflow
-            brainmask_wf = init_brainmask_mp2rage_wf()
+            brainmask_wf = init_brainmask_mp2rage_wf(
+                omp_nthreads=OMP_NTHREADS,
+                denoise_sweep_factors=MP2RAGE_DENOISE_SWEEP,
+            )
             brainmask_inputnode = pe.Node(
                 niu.IdentityInterface(
                     [
@@ -380,7 +419,17 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
                 source_brain,
                 source_brainmask,
                 out_path_base=BRAINMASK_DIR.split("/")[-1],
+                denoise_sweep=bool(MP2RAGE_DENOISE_SWEEP),
             )
+            if MP2RAGE_DENOISE_SWEEP:
+                # fmt: off
+                wf.connect([
+                    (brainmask_wf, anat_brainmask_derivatives_wf, [
+                        ("outputnode.mp2rage_denoised_sweep", "inputnode.mp2rage_denoised_sweep"),
+                        ("outputnode.denoise_sweep_metrics", "inputnode.denoise_sweep_metrics"),
+                    ]),
+                ])
+                # fmt: on
             # connect
             # fmt: off
             wf.connect([
@@ -540,7 +589,7 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
     # Checkpoint
     if args.anat_flag:
         print("\n[anat_flag] invoked.\nOnly running anatomical" " processing pipeline.")
-        wf.run()
+        wf.run(**PLUGIN_SETTINGS)
         return 0
 
     """
@@ -917,7 +966,13 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         slabref_bold_ref_wf = init_bold_ref_wf(
             slabref_bold,
             split_vol_id=BOLD_REF_VOL_IDX,
+            n_ref_vols=BOLD_REF_N_VOLS,
             pca_denoise=BOLD_HMC_MPPCA,
+            pca_denoise_method=BOLD_HMC_MPPCA_METHOD,
+            pca_denoise_mask=BOLD_HMC_MPPCA_MASK,
+            pca_denoise_mem_gb=BOLD_HMC_MPPCA_MEM_GB,
+            pca_denoise_cache_dir=PCA_CACHE_DIR,
+            pca_denoise_cache_gb=BOLD_HMC_MPPCA_CACHE_GB,
             name="slab_reference_reference_wf",
         )
         # connect
@@ -1117,6 +1172,8 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
     """
     Set-up slab bold workflows
     """
+    # T1w->MNI152NLin6Asym transforms are shared by all slab bold runs
+    combine_xfms_wf = None
     for bold_idx, (
         processed_flag,
         select_task_flag,
@@ -1146,6 +1203,10 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         bold_slab_base = f"slab_bold_{task}_{run}"
         # get metadata
         metadata = layout.get_metadata(bold_slab)
+        # memory estimates (header-only)
+        bold_mem_gb = estimate_bold_mem_gb(
+            bold_slab, anat_path=list(ANAT_FILES.values())[0]
+        )
         # slab bold inputnode
         slab_inputnode = pe.Node(
             niu.IdentityInterface(["slab_bold"]),
@@ -1156,7 +1217,13 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         slab_bold_ref_wf = init_bold_ref_wf(
             bold_slab,
             split_vol_id=BOLD_REF_VOL_IDX,
+            n_ref_vols=BOLD_REF_N_VOLS,
             pca_denoise=BOLD_HMC_MPPCA,
+            pca_denoise_method=BOLD_HMC_MPPCA_METHOD,
+            pca_denoise_mask=BOLD_HMC_MPPCA_MASK,
+            pca_denoise_mem_gb=BOLD_HMC_MPPCA_MEM_GB,
+            pca_denoise_cache_dir=PCA_CACHE_DIR,
+            pca_denoise_cache_gb=BOLD_HMC_MPPCA_CACHE_GB,
             name=f"{bold_slab_base}_reference_wf",
         )
         """
@@ -1171,9 +1238,19 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         ), "RepetitionTime metadata is unavailable."
         slab_bold_hmc_wf = init_bold_hmc_wf(
             low_pass_threshold=BOLD_HMC_LOWPASS_THRESHOLD,
+            low_pass_mask=BOLD_HMC_LOWPASS_MASK,
             pca_denoise=BOLD_HMC_MPPCA,
+            pca_denoise_method=BOLD_HMC_MPPCA_METHOD,
+            pca_denoise_mask=BOLD_HMC_MPPCA_MASK,
+            pca_denoise_mem_gb=BOLD_HMC_MPPCA_MEM_GB,
+            pca_denoise_cache_dir=PCA_CACHE_DIR,
+            pca_denoise_cache_gb=BOLD_HMC_MPPCA_CACHE_GB,
             cost_function=BOLD_HMC_COST_FUNCTION,
             bold_hmc_n4=BOLD_HMC_N4,
+            bold_hmc_n4_mode=BOLD_HMC_N4_MODE,
+            hmc_engine=BOLD_HMC_ENGINE,
+            export_fsl_mats=BOLD_HMC_SAVE_MATS_TAR,
+            omp_nthreads=OMP_NTHREADS,
             name=f"{bold_slab_base}_hmc_wf",
         )
         slab_bold_hmc_wf.inputs.inputnode.bold_metadata = metadata
@@ -1216,6 +1293,14 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
             (slabref_bold_buffer, slab_bold_brainmask_wf, [("proc_itk_wholebrain_to_slabref_bold", "inputnode.itk_wholebrain_to_slabref_bold")])
         ])
         # fmt: on
+        if (BOLD_HMC_MPPCA and BOLD_HMC_MPPCA_MASK == "brainmask") or (
+            BOLD_HMC_LOWPASS_THRESHOLD > 0 and BOLD_HMC_LOWPASS_MASK == "brainmask"
+        ):
+            # fmt: off
+            wf.connect([
+                (slab_bold_brainmask_wf, slab_bold_hmc_wf, [("outputnode.brainmask", "inputnode.bold_mask")]),
+            ])
+            # fmt: on
 
         """
         Merge and apply transforms
@@ -1236,11 +1321,23 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
             )
         )
         # apply all transformations to slab bold
-        trans_slab_bold_to_anat_wf = init_apply_bold_to_anat_wf(
-            slab_bold_quick=args.slab_bold_quick,
-            name=f"trans_{bold_slab_base}_to_t1_wf",
-        )
-        trans_slab_bold_to_anat_wf.inputs.inputnode.bold_metadata = metadata
+        if args.bold_fused_resampling:
+            # slice-timing, hmc and all registrations in one interpolation
+            trans_slab_bold_to_anat_wf = init_apply_bold_fused_wf(
+                metadata,
+                slice_timing_correction=not BOLD_STC_OFF,
+                slab_bold_quick=args.slab_bold_quick,
+                omp_nthreads=OMP_NTHREADS,
+                name=f"trans_{bold_slab_base}_to_t1_wf",
+            )
+        else:
+            trans_slab_bold_to_anat_wf = init_apply_bold_to_anat_wf(
+                slab_bold_quick=args.slab_bold_quick,
+                resample_engine=args.bold_to_t1_engine,
+                omp_nthreads=OMP_NTHREADS,
+                name=f"trans_{bold_slab_base}_to_t1_wf",
+            )
+            trans_slab_bold_to_anat_wf.inputs.inputnode.bold_metadata = metadata
 
         if use_fmaps:
             NotImplemented
@@ -1252,7 +1349,7 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
 
         # connect bold image that is to be transformed to t1 space
         # this depends on whether STC is used.
-        if not BOLD_STC_OFF:
+        if not BOLD_STC_OFF and not args.bold_fused_resampling:
             assert bool(metadata["SliceTiming"]), "SliceTiming metadata is unavailable."
             slab_bold_stc_wf = init_bold_stc_wf(
                 metadata=metadata, name=f"{bold_slab_base}_stc_wf"
@@ -1265,6 +1362,7 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
             ])
             # fmt: on
         else:
+            # fused resampling corrects slice-timing on the raw slab bold
             # fmt: off
             wf.connect([(slab_inputnode, trans_slab_bold_to_anat_wf, [("slab_bold", "inputnode.bold_file")])])
             # fmt: on
@@ -1286,7 +1384,7 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
                 ("outputnode.slab2anat_warp", "inputnode.bold_to_t1_warp"),
                 ("outputnode.reference_resampled", "inputnode.t1_resampled")
             ]),
-            (slab_bold_hmc_wf, trans_slab_bold_to_anat_wf, [("outputnode.fsl_affines", "inputnode.fsl_hmc_affines")]),
+            (slab_bold_hmc_wf, trans_slab_bold_to_anat_wf, [("outputnode.hmc_affines", "inputnode.hmc_affines")]),
             (slab_bold_ref_wf, trans_slab_bold_to_anat_wf, [("outputnode.boldref", "inputnode.bold_ref")]),
             (trans_slab_bold_to_anat_wf, trans_slab_bold_brainmask_to_anat_wf, [("outputnode.t1_space_boldref", "inputnode.t1_boldref")])
         ])
@@ -1300,7 +1398,7 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         )
 
         slab_bold_confs_wf = init_bold_confs_wf(
-            mem_gb=8,
+            mem_gb=2 * bold_mem_gb["t1"],
             metadata=metadata,
             freesurfer=True,
             regressors_all_comps=False,
@@ -1332,15 +1430,15 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         from fmriprep.workflows.bold.resampling import init_bold_grayords_wf
         from fmriprep.workflows.bold.resampling import init_bold_surf_wf
 
-        from pathlib import Path
         from templateflow import api as tflow
-        from nipype.interfaces.ants import RegistrationSynQuick
         from nipype.interfaces.utility import Function
         from nipype.interfaces.ants import ApplyTransforms
+        from oscprep.interfaces.sparse_resample import SparseApplyTransforms
+        from oscprep.interfaces.template_registration import TemplateRegistration
 
         # Resample BOLD to freesurfer surface
         slab_bold_surf_wf = init_bold_surf_wf(
-            mem_gb=8,
+            mem_gb=bold_mem_gb["t1"],
             surface_spaces=["fsaverage"],
             medial_surface_nan=None,
             project_goodvoxels=False,
@@ -1359,70 +1457,108 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         ])
         # fmt: on
 
-        # Estimate transform (T1w->MNI152NLin6Asym)
+        # Estimate transform (T1w->MNI152NLin6Asym), once per subject and
+        # cached in the derivatives directory
         standard_space = "MNI152NLin6Asym"
         template_img = tflow.get(
             standard_space, resolution=2, desc=None, suffix="T1w", extension="nii.gz"
         )
-        trans_slab_bold_to_std_est_wf = pe.Node(
-            RegistrationSynQuick(), name=f"{bold_slab_base}_boldt1w_to_std_estimate"
-        )
-        trans_slab_bold_to_std_est_wf.inputs.fixed_image = template_img
-        # fmt: off
-        wf.connect([
-            (anat_buffer, trans_slab_bold_to_std_est_wf, [("fs_t1w_brain","moving_image")])
-        ])
-        # fmt: on
+        if combine_xfms_wf is None:
+            trans_t1w_to_std_est_wf = pe.Node(
+                TemplateRegistration(
+                    fixed_image=template_img,
+                    template=standard_space,
+                    cache_dir=TEMPLATE_REG_DIR,
+                    num_threads=OMP_NTHREADS,
+                ),
+                name="t1w_to_std_estimate",
+                n_procs=OMP_NTHREADS,
+                mem_gb=4,
+            )
+            # fmt: off
+            wf.connect([
+                (anat_buffer, trans_t1w_to_std_est_wf, [("fs_t1w_brain","moving_image")])
+            ])
+            # fmt: on
 
-        # Combine transforms into a list (linear affine + nonlinear warp)
-        def combine_xfms(xfm1, xfm2):
-            return [xfm2, xfm1]
+            # Combine transforms into a list (linear affine + nonlinear warp)
+            def combine_xfms(xfm1, xfm2):
+                return [xfm2, xfm1]
 
-        combine_xfms_wf = pe.Node(
-            Function(
-                input_names=["xfm1", "xfm2"],
-                output_names=["output"],
-                function=combine_xfms,
-            ),
-            name=f"{bold_slab_base}_boldt1w_to_std_combine_xfms",
-        )
-        # fmt: off
-        wf.connect([
-            (trans_slab_bold_to_std_est_wf, combine_xfms_wf, [
-                ("out_matrix","xfm1"),
-                ("forward_warp_field","xfm2")
+            combine_xfms_wf = pe.Node(
+                Function(
+                    input_names=["xfm1", "xfm2"],
+                    output_names=["output"],
+                    function=combine_xfms,
+                ),
+                name="t1w_to_std_combine_xfms",
+            )
+            # fmt: off
+            wf.connect([
+                (trans_t1w_to_std_est_wf, combine_xfms_wf, [
+                    ("out_matrix","xfm1"),
+                    ("forward_warp_field","xfm2")
+                ])
             ])
-        ])
-        # fmt: on
+            # fmt: on
 
         # Apply transform (T1w->MNI152NLin6Asym) to bold
-        trans_slab_bold_to_std_apply_wf = pe.Node(
-            ApplyTransforms(
-                reference_image=template_img,
-                interpolation="LanczosWindowedSinc",
-                input_image_type=3,
-                output_image=f"space-{standard_space}_bold.nii.gz",
-            ),
-            name=f"{bold_slab_base}_boldt1w_to_std_apply",
-        )
-        # fmt: off
-        wf.connect([
-            (trans_slab_bold_to_anat_wf, trans_slab_bold_to_std_apply_wf, [("outputnode.t1_space_bold", "input_image")]),
-            (combine_xfms_wf, trans_slab_bold_to_std_apply_wf, [("output", "transforms")])
-        ])
-        # fmt: on
+        if args.bold_fused_resampling:
+            trans_slab_bold_to_anat_wf.inputs.inputnode.std_reference = template_img
+            # fmt: off
+            wf.connect([
+                (combine_xfms_wf, trans_slab_bold_to_anat_wf, [("output", "inputnode.std_transforms")])
+            ])
+            # fmt: on
+        else:
+            if args.bold_std_resample_engine == "sparse":
+                std_apply = SparseApplyTransforms(
+                    reference_image=template_img,
+                    output_image=f"space-{standard_space}_bold.nii.gz",
+                    cache_dir=RESAMPLING_CACHE_DIR,
+                )
+            else:
+                std_apply = ApplyTransforms(
+                    reference_image=template_img,
+                    interpolation="LanczosWindowedSinc",
+                    input_image_type=3,
+                    output_image=f"space-{standard_space}_bold.nii.gz",
+                    num_threads=OMP_NTHREADS,
+                )
+            trans_slab_bold_to_std_apply_wf = pe.Node(
+                std_apply,
+                name=f"{bold_slab_base}_boldt1w_to_std_apply",
+                n_procs=(
+                    1 if args.bold_std_resample_engine == "sparse" else OMP_NTHREADS
+                ),
+                mem_gb=bold_mem_gb["t1"] + bold_mem_gb["std"],
+            )
+            # fmt: off
+            wf.connect([
+                (trans_slab_bold_to_anat_wf, trans_slab_bold_to_std_apply_wf, [("outputnode.t1_space_bold", "input_image")]),
+                (combine_xfms_wf, trans_slab_bold_to_std_apply_wf, [("output", "transforms")])
+            ])
+            # fmt: on
 
         # Resample bold to 32k grayordinate space
-        mni_out_bold = Path(
-            f"{args.scratch_dir}/oscprep_sub-{SUBJECT_ID}_session-{SESSION_ID}_{workflow_suffix}v{_OSCPREP_VERSION}/{bold_slab_base}_boldt1w_to_std_apply/space-{standard_space}_bold.nii.gz"
-        )
         slab_bold_grayords_wf = init_bold_grayords_wf(
             grayord_density="91k",
-            mem_gb=8,
+            mem_gb=bold_mem_gb["std"],
             repetition_time=metadata["RepetitionTime"],
             name=f"{bold_slab_base}_grayords_wf",
         )
-        slab_bold_grayords_wf.inputs.inputnode.bold_std = [mni_out_bold]
+        if args.bold_fused_resampling:
+            # fmt: off
+            wf.connect([
+                (trans_slab_bold_to_anat_wf, slab_bold_grayords_wf, [(("outputnode.std_space_bold", _listify), "inputnode.bold_std")])
+            ])
+            # fmt: on
+        else:
+            # fmt: off
+            wf.connect([
+                (trans_slab_bold_to_std_apply_wf, slab_bold_grayords_wf, [(("output_image", _listify), "inputnode.bold_std")])
+            ])
+            # fmt: on
         slab_bold_grayords_wf.inputs.inputnode.spatial_reference = (
             f"{standard_space}_res-2"
         )
@@ -1463,8 +1599,19 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
             source_preproc_slab_bold["slab_bold_to_t1_warp"],
             bold_slab_base,
             use_fmaps=use_fmaps,
+            bold_hmc_mats_base=(
+                source_preproc_slab_bold["bold_hmc_mats"]
+                if BOLD_HMC_SAVE_MATS_TAR
+                else None
+            ),
             out_path_base=BOLD_PREPROC_DIR.split("/")[-1],
         )
+        if BOLD_HMC_SAVE_MATS_TAR:
+            # fmt: off
+            wf.connect([
+                (slab_bold_hmc_wf, slab_bold_preproc_derivatives_wf, [("outputnode.fsl_affines", "inputnode.bold_hmc_mats")])
+            ])
+            # fmt: on
 
         if use_fmaps:
             NotImplemented
@@ -1494,7 +1641,7 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
                 ("outputnode.crown_mask", "inputnode.bold_crownmask"),
                 ("outputnode.rois_plot", "inputnode.bold_roi_svg")
             ]),
-            (slab_bold_hmc_wf, slab_bold_preproc_derivatives_wf, [("outputnode.fsl_affines", "inputnode.bold_hmc")]),
+            (slab_bold_hmc_wf, slab_bold_preproc_derivatives_wf, [("outputnode.hmc_affines", "inputnode.bold_hmc")]),
             (slab_to_slabref_bold_wf, slab_bold_preproc_derivatives_wf, [
                 ("outputnode.fsl_slab_to_slabref_bold", "inputnode.slab_bold_to_slabref_bold_mat"),
                 ("outputnode.out_report", "inputnode.slab_bold_to_slabref_bold_svg"),
@@ -1507,13 +1654,54 @@ BOLD_PREPROC_DIR: {BOLD_PREPROC_DIR}
         ])
         # fmt: on
 
-    wf.run()
+        # Resource estimates of the remaining slab bold nodes, nodes of the
+        # series workflows which only handle single volumes (or motion
+        # parameters) are estimated per volume
+        SLAB_BOLD_VOLUME_NODES = [
+            "extract_boldref",
+            "apply_n4_to_boldref",
+            "estimate_bias_field",
+            "normalize_motion",
+            "hmc_affines",
+            "apply_bold_ref_to_t1",
+        ]
+        slab_bold_resources = [
+            (slab_bold_ref_wf, bold_mem_gb["native"]),
+            # raw, low-pass filtered and pca-denoised series
+            (slab_bold_hmc_wf, 3 * bold_mem_gb["native"]),
+            (slab_to_slabref_bold_wf, bold_mem_gb["volume"]),
+            (slab_bold_brainmask_wf, bold_mem_gb["volume"]),
+            (merge_transforms_wf, bold_mem_gb["volume"]),
+            (trans_slab_bold_brainmask_to_anat_wf, bold_mem_gb["volume"]),
+            # native series and t1-space series with its source coordinates
+            (trans_slab_bold_to_anat_wf, bold_mem_gb["native"] + 2 * bold_mem_gb["t1"]),
+            (slab_bold_confs_wf, 2 * bold_mem_gb["t1"]),
+            (slab_bold_surf_wf, bold_mem_gb["t1"]),
+            (slab_bold_grayords_wf, bold_mem_gb["std"]),
+            (slab_bold_preproc_derivatives_wf, bold_mem_gb["std"]),
+        ]
+        if not BOLD_STC_OFF and not args.bold_fused_resampling:
+            slab_bold_resources.append((slab_bold_stc_wf, 2 * bold_mem_gb["native"]))
+        for _wf, _mem_gb in slab_bold_resources:
+            set_workflow_resources(
+                _wf,
+                _mem_gb,
+                volume_mem_gb=bold_mem_gb["volume"],
+                n_procs=OMP_NTHREADS,
+                volume_nodes=SLAB_BOLD_VOLUME_NODES,
+            )
+
+    wf.run(**PLUGIN_SETTINGS)
 
 
 def _get_element(_list, element_idx):
     return _list[element_idx]
 
 
+def _listify(_path):
+    return [_path]
+
+
 def _jsonify(_dict):
     import json
     import os
@@ -0,0 +1,83 @@
+from nipype.interfaces.base import (
+    File,
+    SimpleInterface,
+    TraitedSpec,
+)
+
+import os
+
+BIAS_CORRECTED_BASE = "n4_bold.nii.gz"
+
+
+def _ApplyBiasField(bold_path, bias_field_path, outfile=BIAS_CORRECTED_BASE):
+    """
+    Divide every volume of a bold series by a (3D) bias field, as
+    N4BiasFieldCorrection does with the field it estimates. The series is
+    memory-mapped and written volume by volume as float32.
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.utils.nifti_io import Nifti4DWriter, open_nifti_memmap
+
+    img, data, scratch_file = open_nifti_memmap(bold_path)
+    slope, inter = float(img.dataobj.slope), float(img.dataobj.inter)
+
+    bias = np.asarray(nib.load(bias_field_path).dataobj, dtype=np.float32)
+    bias = bias.reshape(bias.shape[:3])
+    assert (
+        bias.shape == img.shape[:3]
+    ), f"bias field shape {bias.shape} does not match bold shape {img.shape}."
+    # voxels without a valid field estimate are left unchanged
+    inv_bias = np.ones_like(bias)
+    np.divide(1, bias, out=inv_bias, where=bias > 0)
+
+    writer = Nifti4DWriter(
+        outfile,
+        img.shape,
+        img.affine,
+        header=img.header,
+        repetition_time=float(img.header.get_zooms()[3]),
+    )
+    for vol_idx in range(img.shape[-1]):
+        vol = np.asarray(data[..., vol_idx], dtype=np.float32) * np.float32(slope)
+        vol += np.float32(inter)
+        vol *= inv_bias
+        writer.write_volume(vol_idx, vol)
+    writer.close()
+
+    del data
+    if scratch_file is not None:
+        os.remove(scratch_file)
+
+
+class ApplyBiasFieldInputSpec(TraitedSpec):
+    bold_path = File(exists=True, desc="bold path", mandatory=True)
+    bias_field = File(
+        exists=True,
+        desc="bias field estimated on a 3D image of the bold grid",
+        mandatory=True,
+    )
+
+
+class ApplyBiasFieldOutputSpec(TraitedSpec):
+    n4_bold = File(exists=True, desc="bias field corrected bold path")
+
+
+class ApplyBiasField(SimpleInterface):
+    """
+    Bias field correct a bold series with a single, precomputed bias field
+    """
+
+    input_spec = ApplyBiasFieldInputSpec
+    output_spec = ApplyBiasFieldOutputSpec
+
+    def _run_interface(self, runtime):
+        _ApplyBiasField(self.inputs.bold_path, self.inputs.bias_field)
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["n4_bold"] = os.path.abspath(BIAS_CORRECTED_BASE)
+
+        return outputs
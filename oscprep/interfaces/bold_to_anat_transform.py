@@ -9,6 +9,7 @@ from nipype.interfaces.base import (
 import os
 
 BOLD_TO_T1_BASE = "space-t1_bold.nii.gz"
+CHECKPOINT_BASE = "space-t1_bold_checkpoint.json"
 
 
 def _BoldToT1Transform(
@@ -18,69 +19,305 @@ def _BoldToT1Transform(
     t1_resampled,
     repetition_time,
     debug,
+    engine="native",
+    n_procs=1,
+):
+    if engine == "native":
+        _NativeBoldToT1Transform(
+            bold_path,
+            hmc_mats,
+            bold_to_t1_warp,
+            t1_resampled,
+            repetition_time,
+            debug,
+            n_procs=n_procs,
+        )
+    else:
+        _FSLBoldToT1Transform(
+            bold_path,
+            hmc_mats,
+            bold_to_t1_warp,
+            t1_resampled,
+            repetition_time,
+            debug,
+            n_procs=n_procs,
+        )
+
+    # Assertion
+    assert os.path.exists(BOLD_TO_T1_BASE), f"{BOLD_TO_T1_BASE} was not created."
+
+
+def _open_checkpointed_writer(checkpoint_key, t1_img, n_vols, repetition_time):
+    """
+    Open the 4D output writer together with its checkpoint manifest.
+    Returns the index of the first volume that still has to be computed.
+    """
+    from oscprep.utils.checkpoint import VolumeCheckpoint
+    from oscprep.utils.nifti_io import Nifti4DWriter
+
+    checkpoint = VolumeCheckpoint(os.path.abspath(CHECKPOINT_BASE), checkpoint_key)
+    # Volumes are streamed into a preallocated memory-mapped 4D output
+    writer = Nifti4DWriter(
+        BOLD_TO_T1_BASE,
+        (*t1_img.shape[:3], n_vols),
+        t1_img.affine,
+        header=t1_img.header,
+        repetition_time=repetition_time,
+        resume=bool(checkpoint.volumes),
+    )
+
+    start_ix = 0
+    if writer.resumed:
+        start_ix = checkpoint.resume_index(writer.read_volume, n_vols)
+        print(f"Resuming from volume {start_ix} of {n_vols}.")
+    else:
+        checkpoint.volumes = {}
+
+    return writer, checkpoint, start_ix
+
+
+def _precompute_source_coords(bold_to_t1_warp, t1_resampled):
+    """
+    Read `bold_to_t1_warp` once and convert it into homogeneous FSL mm
+    coordinates (4, n_voxels) of the bold reference volume for every
+    voxel of the `t1_resampled` grid
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.utils.transforms import fsl_warp_to_source_mm
+
+    src_mm = fsl_warp_to_source_mm(nib.load(bold_to_t1_warp), nib.load(t1_resampled))
+
+    return np.vstack([src_mm, np.ones((1, src_mm.shape[1]), dtype=np.float32)])
+
+
+def _native_transform_volume(vol_data, vol_mat, src_coords, bold_scaling, t1_shape):
+    """
+    Map the cached `src_coords` through the (4x4, FSL) hmc affine `vol_mat`
+    and resample `vol_data` onto the t1 grid with trilinear interpolation
+    """
+    import numpy as np
+    from scipy.ndimage import map_coordinates
+
+    # FSL mm (reference volume) -> FSL mm (volume) -> voxel (volume)
+    vox_from_ref_mm = np.linalg.inv(bold_scaling) @ np.linalg.inv(vol_mat)
+    coords = vox_from_ref_mm[:3].astype(np.float32) @ src_coords
+
+    vol_t1 = map_coordinates(
+        vol_data, coords, order=1, mode="constant", cval=0.0, prefilter=False
+    )
+
+    return vol_t1.reshape(t1_shape[:3], order="F")
+
+
+# Per-process state shared by all volumes handled by a pool worker
+_NATIVE_WORKER_STATE = {}
+
+
+def _init_native_worker(coords_path, bold_scaling, t1_shape):
+    import numpy as np
+
+    _NATIVE_WORKER_STATE["src_coords"] = np.load(coords_path, mmap_mode="r")
+    _NATIVE_WORKER_STATE["bold_scaling"] = bold_scaling
+    _NATIVE_WORKER_STATE["t1_shape"] = t1_shape
+
+
+def _native_transform_task(task):
+    vol_data, vol_mat = task
+
+    return _native_transform_volume(
+        vol_data,
+        vol_mat,
+        _NATIVE_WORKER_STATE["src_coords"],
+        _NATIVE_WORKER_STATE["bold_scaling"],
+        _NATIVE_WORKER_STATE["t1_shape"],
+    )
+
+
+def _NativeBoldToT1Transform(
+    bold_path,
+    hmc_mats,
+    bold_to_t1_warp,
+    t1_resampled,
+    repetition_time,
+    debug,
+    n_procs=1,
+):
+    """
+    Resample every volume of `bold_path` to `t1_resampled` in-process,
+    reading the 4D bold data once and writing a single 4D output
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.utils.parallel import imap_ordered
+    from oscprep.utils.transforms import fsl_scaling_matrix, load_hmc_affines
+
+    bold_img = nib.load(bold_path)
+    t1_img = nib.load(t1_resampled)
+    bold_scaling = fsl_scaling_matrix(bold_img)
+    hmc_affines = load_hmc_affines(hmc_mats)
+    # The warp is shared by all volumes, only the hmc affine changes.
+    # Cache it on disk so pool workers can memory-map it.
+    coords_path = os.path.abspath("bold_to_t1_coords.npy")
+    np.save(coords_path, _precompute_source_coords(bold_to_t1_warp, t1_resampled))
+
+    n_vols = bold_img.shape[3]
+    assert n_vols == len(hmc_affines), "hmc mats and bold data are not equal lengths."
+    if debug:
+        n_vols = min(n_vols, 10)
+
+    writer, checkpoint, start_ix = _open_checkpointed_writer(
+        {
+            "engine": "native",
+            "bold_path": bold_path,
+            "hmc_mats": list(hmc_mats),
+            "bold_to_t1_warp": bold_to_t1_warp,
+            "t1_resampled": t1_resampled,
+            "n_vols": n_vols,
+        },
+        t1_img,
+        n_vols,
+        repetition_time,
+    )
+
+    bold_data = np.asarray(
+        bold_img.dataobj[..., start_ix:n_vols], dtype=np.float32
+    ).reshape(*bold_img.shape[:3], -1)
+    tasks = (
+        (bold_data[..., ix - start_ix], hmc_affines[ix])
+        for ix in range(start_ix, n_vols)
+    )
+    for ix, vol_t1 in enumerate(
+        imap_ordered(
+            _native_transform_task,
+            tasks,
+            n_procs=n_procs,
+            initializer=_init_native_worker,
+            initargs=(coords_path, bold_scaling, t1_img.shape),
+        ),
+        start=start_ix,
+    ):
+        writer.write_volume(ix, vol_t1)
+        checkpoint.record(ix, writer.read_volume(ix))
+
+    writer.close()
+    checkpoint.remove()
+    os.remove(coords_path)
+
+
+def _fsl_transform_task(task):
+    """
+    Combine a volume's hmc affine with the bold-to-t1 warp and apply
+    the combined warp to the volume
+    """
+    from nipype.interfaces import fsl
+
+    ix, vol_mat, vol_bold, bold_to_t1_warp, t1_resampled = task
+
+    # Combine `vol_mat` with `bold_to_t1_warp``
+    convert_warp = fsl.ConvertWarp(
+        reference=t1_resampled,
+        premat=vol_mat,
+        warp1=bold_to_t1_warp,
+        out_file=os.path.abspath(f"vol{ix:04d}_concatwarp.nii.gz"),
+    )
+    res = convert_warp.run()
+    vol_warp = res.outputs.out_file
+    # Apply the new warp to `vol_bold`
+    apply_warp = fsl.ApplyWarp(
+        in_file=vol_bold,
+        ref_file=t1_resampled,
+        field_file=vol_warp,
+    )
+    res = apply_warp.run()
+    # the combined warp is only needed for this volume
+    os.remove(vol_warp)
+
+    return res.outputs.out_file, convert_warp.cmdline, apply_warp.cmdline
+
+
+def _FSLBoldToT1Transform(
+    bold_path,
+    hmc_mats,
+    bold_to_t1_warp,
+    t1_resampled,
+    repetition_time,
+    debug,
+    n_procs=1,
 ):
     from nipype.interfaces import fsl
     import nibabel as nib
+    import numpy as np
+    from oscprep.utils.parallel import imap_ordered
+    from oscprep.utils.transforms import export_fsl_mats
 
+    # ConvertWarp reads per-volume FSL mat files
+    mat_list = export_fsl_mats(hmc_mats, os.path.abspath("hmc_affines.mat"))
     split_bold = fsl.Split(dimension="t", in_file=bold_path)
     res = split_bold.run()
     bold_list = res.outputs.out_files
 
-    vol_t1_bold = []
     assert len(bold_list) == len(
-        hmc_mats
+        mat_list
     ), "hmc mats and split bold data are not equal lengths."
-    for ix, (vol_mat, vol_bold) in enumerate(zip(hmc_mats, bold_list)):
-        if debug and ix == 10:
-            break
-
-        # Combine `vol_mat` with `bold_to_t1_warp``
-        convert_warp = fsl.ConvertWarp(
-            reference=t1_resampled,
-            premat=vol_mat,
-            warp1=bold_to_t1_warp,
-        )
-        res = convert_warp.run()
-        vol_warp = res.outputs.out_file
-        # Apply the new warp to `vol_bold`
-        apply_warp = fsl.ApplyWarp(
-            in_file=vol_bold,
-            ref_file=t1_resampled,
-            field_file=vol_warp,
-        )
-        res = apply_warp.run()
-        vol_out = res.outputs.out_file
+    n_vols = min(len(bold_list), 10) if debug else len(bold_list)
+    writer, checkpoint, start_ix = _open_checkpointed_writer(
+        {
+            "engine": "fsl",
+            "bold_path": bold_path,
+            "hmc_mats": list(hmc_mats),
+            "bold_to_t1_warp": bold_to_t1_warp,
+            "t1_resampled": t1_resampled,
+            "n_vols": n_vols,
+        },
+        nib.load(t1_resampled),
+        n_vols,
+        repetition_time,
+    )
+    # volumes already written (resumed run) or left out (debug) are not needed
+    for vol_bold in bold_list[:start_ix] + bold_list[n_vols:]:
+        os.remove(vol_bold)
+    tasks = (
+        (ix, mat_list[ix], bold_list[ix], bold_to_t1_warp, t1_resampled)
+        for ix in range(start_ix, n_vols)
+    )
 
-        vol_t1_bold.append(vol_out)
+    print("Merge the following volumes:")
+    for ix, (vol_out, convert_cmd, apply_cmd) in enumerate(
+        imap_ordered(_fsl_transform_task, tasks, n_procs=n_procs),
+        start=start_ix,
+    ):
+        writer.write_volume(ix, np.asanyarray(nib.load(vol_out).dataobj))
+        checkpoint.record(ix, writer.read_volume(ix))
+        print(f"    - {vol_out}")
+        os.remove(vol_out)
+        os.remove(bold_list[ix])
 
-        if ix == 0:
+        if ix == start_ix:
             print(
                 f"""
             Command examples for one iteration of merging
             hmc affine and t1 warp and applying the warp.
             [cmd] Merge affine and warp:
-            {convert_warp.cmdline}
+            {convert_cmd}
             [cmd] Apply merged warp:
-            {apply_warp.cmdline}
+            {apply_cmd}
             """
             )
 
-    # Verbose
-    print("Merge the following volumes:")
-    for _vol in vol_t1_bold:
-        print(f"    - {_vol}")
-    # Save merged volume as nifti
-    merged_nii = nib.funcs.concat_images(vol_t1_bold)
-    nib.save(merged_nii, BOLD_TO_T1_BASE)
-    # Assertion
-    assert os.path.exists(BOLD_TO_T1_BASE), f"{BOLD_TO_T1_BASE} was not created."
+    # Finalize the merged volume as nifti
+    writer.close()
+    checkpoint.remove()
 
 
 class BoldToT1TransformInputSpec(TraitedSpec):
     bold_path = File(exists=True, desc="bold path", mandatory=True)
     hmc_mats = InputMultiObject(
         File(exists=True),
-        desc="list of hmc affine mat files",
+        desc=(
+            "hmc affine store (.npz, see `save_hmc_affines`) or list of"
+            " per-volume FSL mat files"
+        ),
         mandatory=True,
     )
     bold_to_t1_warp = File(exists=True, desc="bold to t1 warp", mandatory=True)
@@ -94,6 +331,21 @@ class BoldToT1TransformInputSpec(TraitedSpec):
         desc="debug generates bold images with the first 10 volumes",
         mandatory=True,
     )
+    engine = traits.Enum(
+        "native",
+        "fsl",
+        usedefault=True,
+        desc=(
+            "resampling engine: `native` resamples all volumes in-process,"
+            " `fsl` runs ConvertWarp and ApplyWarp per volume"
+        ),
+    )
+    num_threads = traits.Int(
+        1,
+        usedefault=True,
+        nohash=True,
+        desc="number of processes used to transform volumes in parallel",
+    )
 
 
 class BoldToT1TransformOutputSpec(TraitedSpec):
@@ -103,6 +355,9 @@ class BoldToT1TransformOutputSpec(TraitedSpec):
 class BoldToT1Transform(SimpleInterface):
     input_spec = BoldToT1TransformInputSpec
     output_spec = BoldToT1TransformOutputSpec
+    # Keep the node directory of an interrupted run so the volume-level
+    # checkpoint can be picked up
+    _can_resume = True
 
     def _run_interface(self, runtime):
         _BoldToT1Transform(
@@ -112,6 +367,8 @@ class BoldToT1Transform(SimpleInterface):
             self.inputs.t1_resampled,
             self.inputs.repetition_time,
             self.inputs.debug,
+            engine=self.inputs.engine,
+            n_procs=self.inputs.num_threads,
         )
 
         return runtime
@@ -0,0 +1,173 @@
+from nipype.interfaces.base import (
+    File,
+    SimpleInterface,
+    TraitedSpec,
+    isdefined,
+    traits,
+)
+
+import os
+
+CONDITIONED_BOLD_BASE = "proc-conditioned_bold.nii.gz"
+
+
+def _ConditionBold(
+    bold_path,
+    repetition_time=None,
+    low_pass_threshold=0,
+    pca_denoise=True,
+    n_components=10,
+    solver="gram",
+    method="global",
+    patch_radius=2,
+    n_procs=1,
+    mask_path=None,
+    auto_mask=False,
+    outfile=CONDITIONED_BOLD_BASE,
+):
+    """
+    Condition a bold series for head-motion correction in memory: the
+    series is loaded once, low-pass filtered (if `low_pass_threshold` > 0)
+    and PCA denoised (if `pca_denoise`), and only the result is written
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.interfaces.low_pass_filter_bold import _lowpass_filter
+    from oscprep.interfaces.pca_denoise import (
+        _intensity_mask,
+        _load_mask,
+        _pca_denoise_data,
+        _voxel_chunks,
+    )
+
+    img = nib.load(bold_path)
+    data = np.asarray(img.dataobj, dtype=np.float32)
+    x, y, z, n_tps = data.shape
+
+    if low_pass_threshold > 0:
+        # ensure_finite
+        data[~np.isfinite(data)] = 0
+        data_2d = data.reshape(-1, n_tps, order="F")
+        # bound the (float64) filter temporaries to ~1GB
+        for i0, i1 in _voxel_chunks(len(data_2d), n_tps, 0.5):
+            data_2d[i0:i1] = _lowpass_filter(
+                data_2d[i0:i1], repetition_time, low_pass_threshold
+            )
+        data = data_2d.reshape(x, y, z, n_tps, order="F")
+
+    if pca_denoise:
+        mask = None
+        if mask_path is not None:
+            mask = _load_mask(mask_path, data.shape)
+        elif auto_mask:
+            mask = _intensity_mask(data.mean(axis=-1))
+        data = _pca_denoise_data(
+            data,
+            n_components=n_components,
+            solver=solver,
+            method=method,
+            patch_radius=patch_radius,
+            n_procs=n_procs,
+            mask=mask,
+        )
+
+    header = img.header.copy()
+    header.set_data_dtype(np.float32)
+    if repetition_time is not None:
+        header.set_xyzt_units(t="sec")
+        zooms = header.get_zooms()
+        header.set_zooms(zooms[:3] + (repetition_time,))
+    nib.save(nib.Nifti1Image(data, affine=img.affine, header=header), outfile)
+
+
+class ConditionBoldInputSpec(TraitedSpec):
+    bold_path = File(exists=True, desc="bold path", mandatory=True)
+    repetition_time = traits.Float(desc="repetition time (TR)")
+    low_pass_threshold = traits.Float(
+        0,
+        usedefault=True,
+        desc="lowpass filtering threshold (no filtering if 0)",
+    )
+    pca_denoise = traits.Bool(True, usedefault=True, desc="PCA denoise")
+    n_components = traits.Int(
+        10, usedefault=True, desc="number of PCA components", mandatory=False
+    )
+    solver = traits.Enum(
+        "gram",
+        "randomized",
+        usedefault=True,
+        desc="eigendecomposition of the timepoint Gram matrix or randomized SVD",
+    )
+    method = traits.Enum(
+        "global",
+        "local",
+        usedefault=True,
+        desc="`global` PCA or `local` MP-PCA (see `PCADenoise`)",
+    )
+    patch_radius = traits.Int(
+        2, usedefault=True, desc="local MP-PCA patch radius (voxels)"
+    )
+    mask_path = File(
+        exists=True,
+        desc="voxels outside of the mask are not denoised (overrides `auto_mask`)",
+    )
+    auto_mask = traits.Bool(
+        False,
+        usedefault=True,
+        desc="restrict denoising to an intensity mask of the mean bold image",
+    )
+    num_threads = traits.Int(
+        1,
+        usedefault=True,
+        nohash=True,
+        desc="number of processes used to denoise local patches",
+    )
+
+
+class ConditionBoldOutputSpec(TraitedSpec):
+    conditioned_bold_path = File(exists=True, desc="conditioned bold path")
+
+
+class ConditionBold(SimpleInterface):
+    """
+    Fused `LowPassFilterBold` and `PCADenoise`, without writing the
+    low-pass filtered intermediate
+    """
+
+    input_spec = ConditionBoldInputSpec
+    output_spec = ConditionBoldOutputSpec
+
+    def _run_interface(self, runtime):
+        low_pass_threshold = self.inputs.low_pass_threshold
+        if low_pass_threshold > 0:
+            assert isdefined(
+                self.inputs.repetition_time
+            ), "repetition_time is required for low-pass filtering."
+
+        _ConditionBold(
+            self.inputs.bold_path,
+            repetition_time=(
+                self.inputs.repetition_time
+                if isdefined(self.inputs.repetition_time)
+                else None
+            ),
+            low_pass_threshold=low_pass_threshold,
+            pca_denoise=self.inputs.pca_denoise,
+            n_components=self.inputs.n_components,
+            solver=self.inputs.solver,
+            method=self.inputs.method,
+            patch_radius=self.inputs.patch_radius,
+            n_procs=self.inputs.num_threads,
+            mask_path=(
+                self.inputs.mask_path if isdefined(self.inputs.mask_path) else None
+            ),
+            auto_mask=self.inputs.auto_mask,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["conditioned_bold_path"] = os.path.abspath(CONDITIONED_BOLD_BASE)
+
+        return outputs
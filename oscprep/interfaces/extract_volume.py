@@ -0,0 +1,65 @@
+from nipype.interfaces.base import (
+    File,
+    SimpleInterface,
+    TraitedSpec,
+    traits,
+)
+
+import os
+
+EXTRACT_VOLUME_BASE = "bold_volume.nii.gz"
+
+
+def _ExtractVolume(in_file, vol_id=0, outfile=EXTRACT_VOLUME_BASE):
+    """
+    Save volume `vol_id` of a 4D image as a 3D image. Only that volume is
+    read (array proxy slicing), and its on-disk data type is kept unless
+    the image has non-trivial intensity scaling (then float32).
+    """
+    import nibabel as nib
+    import numpy as np
+
+    img = nib.load(in_file)
+    n_vols = img.shape[3] if len(img.shape) > 3 else 1
+    assert (
+        -n_vols <= vol_id < n_vols
+    ), f"volume {vol_id} out of range for {n_vols} volumes."
+
+    vol = np.asanyarray(img.dataobj[..., vol_id] if len(img.shape) > 3 else img.dataobj)
+    if img.dataobj.slope == 1 and img.dataobj.inter == 0:
+        vol = vol.astype(img.get_data_dtype(), copy=False)
+    else:
+        vol = vol.astype(np.float32, copy=False)
+
+    header = img.header.copy()
+    header.set_data_dtype(vol.dtype)
+    nib.save(nib.Nifti1Image(vol, img.affine, header), outfile)
+
+
+class ExtractVolumeInputSpec(TraitedSpec):
+    in_file = File(exists=True, desc="4D image", mandatory=True)
+    vol_id = traits.Int(0, usedefault=True, desc="index of the volume to extract")
+
+
+class ExtractVolumeOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="3D volume")
+
+
+class ExtractVolume(SimpleInterface):
+    """
+    Extract a single volume of a 4D image without splitting the series
+    """
+
+    input_spec = ExtractVolumeInputSpec
+    output_spec = ExtractVolumeOutputSpec
+
+    def _run_interface(self, runtime):
+        _ExtractVolume(self.inputs.in_file, vol_id=self.inputs.vol_id)
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(EXTRACT_VOLUME_BASE)
+
+        return outputs
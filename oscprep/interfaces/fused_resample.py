@@ -0,0 +1,316 @@
+from nipype.interfaces.base import (
+    File,
+    InputMultiObject,
+    SimpleInterface,
+    TraitedSpec,
+    isdefined,
+    traits,
+)
+
+import os
+
+FUSED_T1_BASE = "space-t1_bold.nii.gz"
+FUSED_STD_BASE = "space-std_bold.nii.gz"
+
+
+def _slice_timing_correct(
+    data, slice_timing, repetition_time, slice_encoding_direction="k", ref_frac=0.5
+):
+    """
+    Shift every slice of `data` (x, y, z, t) in time to a common reference
+    time point (`ref_frac` between the first and last slice acquisition),
+    using Fourier interpolation after removing the linear trend
+    """
+    import numpy as np
+
+    axis = "ijk".index(slice_encoding_direction[0])
+    slice_timing = np.asarray(slice_timing, dtype=np.float64)
+    if slice_encoding_direction.endswith("-"):
+        slice_timing = slice_timing[::-1]
+    assert len(slice_timing) == data.shape[axis], (
+        f"{len(slice_timing)} slice times for {data.shape[axis]} slices along"
+        f" `{slice_encoding_direction}`."
+    )
+    first, last = slice_timing.min(), slice_timing.max()
+    tzero = np.round(first + ref_frac * (last - first), 3)
+
+    n_tps = data.shape[-1]
+    freqs = np.fft.rfftfreq(n_tps)
+    timepoints = np.arange(n_tps, dtype=np.float64)
+    for slice_idx, slice_time in enumerate(slice_timing):
+        shift = (tzero - slice_time) / repetition_time
+        if shift == 0:
+            continue
+        index = [slice(None)] * 4
+        index[axis] = slice_idx
+        ts = data[tuple(index)].astype(np.float64)
+        # remove the line joining the end points to avoid wrap-around
+        start, end = ts[..., :1], ts[..., -1:]
+        slope = (end - start) / max(n_tps - 1, 1)
+        trend = start + slope * timepoints
+        shifted = np.fft.irfft(
+            np.fft.rfft(ts - trend, axis=-1) * np.exp(2j * np.pi * freqs * shift),
+            n=n_tps,
+            axis=-1,
+        )
+        data[tuple(index)] = shifted + start + slope * (timepoints + shift)
+
+    return data
+
+
+def _std_source_coords(std_reference, std_transforms, t1_resampled, t1_coords):
+    """
+    Map every voxel of `std_reference` through the template transforms to
+    t1 world space and then through the bold-to-t1 warp (cached as
+    `t1_coords` on the `t1_resampled` grid) to FSL mm coordinates of
+    the bold reference volume
+    """
+    import nibabel as nib
+    import numpy as np
+    from scipy.ndimage import map_coordinates
+    from oscprep.utils.transforms import apply_ants_transforms, grid_coordinates
+
+    std_img = nib.load(std_reference)
+    t1_img = nib.load(t1_resampled)
+
+    std_ras = (std_img.affine @ grid_coordinates(std_img.shape))[:3]
+    t1_ras = apply_ants_transforms(std_ras, std_transforms)
+    t1_vox = (
+        np.linalg.inv(t1_img.affine)
+        @ np.vstack([t1_ras, np.ones((1, t1_ras.shape[1]))])
+    )[:3]
+
+    src_coords = np.ones((4, t1_vox.shape[1]), dtype=np.float32)
+    for ax in range(3):
+        src_coords[ax] = map_coordinates(
+            t1_coords[ax].reshape(t1_img.shape[:3], order="F"),
+            t1_vox,
+            order=1,
+            mode="constant",
+            cval=np.nan,
+        )
+    # template voxels outside of the t1 grid are sampled out of bounds
+    src_coords[:3, np.isnan(src_coords[:3]).any(axis=0)] = -1e6
+
+    return src_coords
+
+
+# Per-process state shared by all volumes handled by a pool worker
+_FUSED_WORKER_STATE = {}
+
+
+def _init_fused_worker(coords_paths, bold_scaling, shapes):
+    import numpy as np
+
+    _FUSED_WORKER_STATE["src_coords"] = [
+        np.load(_path, mmap_mode="r") for _path in coords_paths
+    ]
+    _FUSED_WORKER_STATE["bold_scaling"] = bold_scaling
+    _FUSED_WORKER_STATE["shapes"] = shapes
+
+
+def _fused_transform_task(task):
+    from oscprep.interfaces.bold_to_anat_transform import _native_transform_volume
+
+    vol_data, vol_mat = task
+
+    return [
+        _native_transform_volume(
+            vol_data,
+            vol_mat,
+            src_coords,
+            _FUSED_WORKER_STATE["bold_scaling"],
+            shape,
+        )
+        for src_coords, shape in zip(
+            _FUSED_WORKER_STATE["src_coords"], _FUSED_WORKER_STATE["shapes"]
+        )
+    ]
+
+
+def _FusedBoldResample(
+    bold_path,
+    hmc_mats,
+    bold_to_t1_warp,
+    t1_resampled,
+    repetition_time,
+    slice_timing=None,
+    slice_encoding_direction="k",
+    std_reference=None,
+    std_transforms=None,
+    debug=False,
+    n_procs=1,
+):
+    """
+    Resample the raw bold series directly to t1 space (and optionally
+    to a template space) with a single spatial interpolation per volume.
+    Slice-timing correction is applied in the native slice geometry,
+    then each volume is mapped through hmc, the bold-to-t1 warp (sdc and
+    registrations) and the template transforms in one pass.
+    Every output space uses trilinear interpolation: the template series
+    trades the LanczosWindowedSinc of a separate `ApplyTransforms` step for
+    a single interpolation of the raw data.
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.interfaces.bold_to_anat_transform import _precompute_source_coords
+    from oscprep.utils.nifti_io import Nifti4DWriter
+    from oscprep.utils.parallel import imap_ordered
+    from oscprep.utils.transforms import fsl_scaling_matrix, load_hmc_affines
+
+    bold_img = nib.load(bold_path)
+    t1_img = nib.load(t1_resampled)
+    hmc_affines = load_hmc_affines(hmc_mats)
+    n_vols = bold_img.shape[3]
+    assert n_vols == len(hmc_affines), "hmc mats and bold data are not equal lengths."
+
+    # Spatial mappings are shared by all volumes
+    t1_coords = _precompute_source_coords(bold_to_t1_warp, t1_resampled)
+    out_spaces = [(FUSED_T1_BASE, t1_img, t1_coords)]
+    if std_reference is not None:
+        std_img = nib.load(std_reference)
+        std_coords = _std_source_coords(
+            std_reference, std_transforms, t1_resampled, t1_coords
+        )
+        out_spaces.append((FUSED_STD_BASE, std_img, std_coords))
+    # Cache the mappings on disk so pool workers can memory-map them
+    coords_paths = []
+    for out_base, _, src_coords in out_spaces:
+        coords_paths.append(os.path.abspath(out_base.replace(".nii.gz", "_coords.npy")))
+        np.save(coords_paths[-1], src_coords)
+    out_spaces = [(out_base, out_img) for out_base, out_img, _ in out_spaces]
+    del t1_coords, src_coords
+
+    # Temporal interpolation happens in the native slice geometry
+    bold_data = np.asarray(bold_img.dataobj, dtype=np.float32)
+    if slice_timing:
+        bold_data = _slice_timing_correct(
+            bold_data, slice_timing, repetition_time, slice_encoding_direction
+        )
+    if debug:
+        n_vols = min(n_vols, 10)
+
+    writers = [
+        Nifti4DWriter(
+            out_base,
+            (*out_img.shape[:3], n_vols),
+            out_img.affine,
+            header=out_img.header,
+            repetition_time=repetition_time,
+        )
+        for out_base, out_img in out_spaces
+    ]
+    tasks = ((bold_data[..., ix], hmc_affines[ix]) for ix in range(n_vols))
+    for ix, out_vols in enumerate(
+        imap_ordered(
+            _fused_transform_task,
+            tasks,
+            n_procs=n_procs,
+            initializer=_init_fused_worker,
+            initargs=(
+                coords_paths,
+                fsl_scaling_matrix(bold_img),
+                [out_img.shape for _, out_img in out_spaces],
+            ),
+        )
+    ):
+        for writer, out_vol in zip(writers, out_vols):
+            writer.write_volume(ix, out_vol)
+
+    for writer, coords_path in zip(writers, coords_paths):
+        writer.close()
+        os.remove(coords_path)
+
+
+class FusedBoldResampleInputSpec(TraitedSpec):
+    bold_path = File(exists=True, desc="raw bold path", mandatory=True)
+    hmc_mats = InputMultiObject(
+        File(exists=True),
+        desc=(
+            "hmc affine store (.npz, see `save_hmc_affines`) or list of"
+            " per-volume FSL mat files"
+        ),
+        mandatory=True,
+    )
+    bold_to_t1_warp = File(
+        exists=True,
+        desc="bold to t1 warp (sdc and registration chain)",
+        mandatory=True,
+    )
+    t1_resampled = File(
+        exists=True,
+        desc="t1 resampled to resolution of bold data",
+        mandatory=True,
+    )
+    repetition_time = traits.Float(desc="repetition time (TR)", mandatory=True)
+    slice_timing = traits.List(
+        traits.Float,
+        desc="slice acquisition times (s), slice-timing correction is skipped if unset",
+    )
+    slice_encoding_direction = traits.Enum(
+        "k", "k-", "j", "j-", "i", "i-", usedefault=True, desc="slice direction"
+    )
+    std_reference = File(exists=True, desc="template reference image")
+    std_transforms = InputMultiObject(
+        File(exists=True),
+        desc="t1-to-template ants transforms, in antsApplyTransforms order",
+        requires=["std_reference"],
+    )
+    debug = traits.Bool(
+        False,
+        usedefault=True,
+        desc="debug generates bold images with the first 10 volumes",
+    )
+    num_threads = traits.Int(
+        1,
+        usedefault=True,
+        nohash=True,
+        desc="number of processes used to transform volumes in parallel",
+    )
+
+
+class FusedBoldResampleOutputSpec(TraitedSpec):
+    t1_bold_path = File(exists=True, desc="transformed-to-t1 bold path")
+    std_bold_path = File(exists=True, desc="transformed-to-template bold path")
+
+
+class FusedBoldResample(SimpleInterface):
+    """
+    Resample raw bold data to t1 and template space in one pass
+    (trilinear interpolation)
+    """
+
+    input_spec = FusedBoldResampleInputSpec
+    output_spec = FusedBoldResampleOutputSpec
+
+    def _run_interface(self, runtime):
+        std_reference = None
+        if isdefined(self.inputs.std_reference):
+            std_reference = self.inputs.std_reference
+        _FusedBoldResample(
+            self.inputs.bold_path,
+            self.inputs.hmc_mats,
+            self.inputs.bold_to_t1_warp,
+            self.inputs.t1_resampled,
+            self.inputs.repetition_time,
+            slice_timing=(
+                self.inputs.slice_timing
+                if isdefined(self.inputs.slice_timing)
+                else None
+            ),
+            slice_encoding_direction=self.inputs.slice_encoding_direction,
+            std_reference=std_reference,
+            std_transforms=self.inputs.std_transforms,
+            debug=self.inputs.debug,
+            n_procs=self.inputs.num_threads,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["t1_bold_path"] = os.path.abspath(FUSED_T1_BASE)
+        if isdefined(self.inputs.std_reference):
+            outputs["std_bold_path"] = os.path.abspath(FUSED_STD_BASE)
+
+        return outputs
@@ -0,0 +1,82 @@
+from nipype.interfaces.base import (
+    File,
+    InputMultiObject,
+    OutputMultiObject,
+    SimpleInterface,
+    TraitedSpec,
+    traits,
+)
+
+import os
+
+HMC_AFFINES_BASE = "hmc_affines.npz"
+FSL_MATS_DIR = "hmc_affines.mat"
+
+
+def _HMCAffines(mat_files, engine="mcflirt", outfile=HMC_AFFINES_BASE):
+    """
+    Collect per-volume FSL mat files (e.g. MCFLIRT `save_mats`) into a
+    single (N, 4, 4) hmc affine store
+    """
+    from oscprep.utils.transforms import load_hmc_affines, save_hmc_affines
+
+    save_hmc_affines(outfile, load_hmc_affines(mat_files), engine=engine)
+
+
+class HMCAffinesInputSpec(TraitedSpec):
+    mat_files = InputMultiObject(
+        File(exists=True),
+        desc="FSL affine of each volume, in volume order",
+        mandatory=True,
+    )
+    engine = traits.Str("mcflirt", usedefault=True, desc="hmc engine (metadata)")
+
+
+class HMCAffinesOutputSpec(TraitedSpec):
+    hmc_affines = File(exists=True, desc="(N, 4, 4) hmc affine store")
+
+
+class HMCAffines(SimpleInterface):
+    """
+    Pack per-volume FSL hmc affines into a single array file
+    """
+
+    input_spec = HMCAffinesInputSpec
+    output_spec = HMCAffinesOutputSpec
+
+    def _run_interface(self, runtime):
+        _HMCAffines(self.inputs.mat_files, engine=self.inputs.engine)
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["hmc_affines"] = os.path.abspath(HMC_AFFINES_BASE)
+
+        return outputs
+
+
+class ExportFSLMatsInputSpec(TraitedSpec):
+    hmc_affines = File(exists=True, desc="(N, 4, 4) hmc affine store", mandatory=True)
+
+
+class ExportFSLMatsOutputSpec(TraitedSpec):
+    mat_files = OutputMultiObject(File(exists=True), desc="FSL affine of each volume")
+
+
+class ExportFSLMats(SimpleInterface):
+    """
+    Export an hmc affine store as per-volume FSL mat files (MCFLIRT layout)
+    """
+
+    input_spec = ExportFSLMatsInputSpec
+    output_spec = ExportFSLMatsOutputSpec
+
+    def _run_interface(self, runtime):
+        from oscprep.utils.transforms import export_fsl_mats
+
+        self._results["mat_files"] = export_fsl_mats(
+            self.inputs.hmc_affines, os.path.abspath(FSL_MATS_DIR)
+        )
+
+        return runtime
@@ -2,31 +2,128 @@ from nipype.interfaces.base import (
     File,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
 
+from functools import lru_cache
 import os
 
+LP_BOLD_BASE = "proc-lp_bold.nii.gz"
+
+
+@lru_cache(maxsize=32)
+def _lowpass_sos(repetition_time, low_pass, order=5):
+    """
+    Second-order sections of the digital Butterworth low-pass filter
+    applied by `nilearn.signal.butterworth` (used by `nilearn.image.clean_img`),
+    or None if `low_pass` is not below the nyquist frequency (nilearn
+    then skips filtering). Cached per (TR, cutoff).
+    """
+    from scipy import signal
+
+    nyquist = 0.5 / repetition_time
+    if low_pass >= nyquist:
+        return None
+    return signal.butter(order, low_pass / nyquist, btype="low", output="sos")
+
+
+def _lowpass_filter(signals, repetition_time, low_pass):
+    """
+    Low-pass filter `signals` (n_voxels, n_tps) forward and backward
+    (`scipy.signal.sosfiltfilt`, odd padding of scipy's default length) as
+    nilearn does, computed in float64 and returned as float32. Series too
+    short for the default padding are padded with n_tps - 1 samples.
+    """
+    import numpy as np
+    from scipy import signal
+
+    sos = _lowpass_sos(repetition_time, low_pass)
+    if sos is None:
+        return signals.astype(np.float32)
+    # scipy's default padlen of `sosfiltfilt`
+    n_zeros = min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    padlen = min(3 * (2 * len(sos) + 1 - n_zeros), signals.shape[1] - 1)
+    filtered = signal.sosfiltfilt(
+        sos,
+        signals.astype(np.float64),
+        axis=1,
+        padtype="odd",
+        padlen=padlen,
+    )
 
-def _LowPassFilterBold(bold_path, repetition_time, lp=0.2):
-    """ """
+    return filtered.astype(np.float32)
+
+
+def _LowPassFilterBold(
+    bold_path,
+    repetition_time,
+    lp=0.2,
+    mask_path=None,
+    auto_mask=False,
+    mem_budget_gb=1.0,
+    outfile=LP_BOLD_BASE,
+):
+    """
+    Low-pass filter a bold series chunk by chunk: the series is
+    memory-mapped, filtered over voxel chunks (within `mask_path`, or
+    an intensity mask with `auto_mask`) and streamed to a float32 output
+    """
     import nibabel as nib
-    from nilearn import image
-
-    lp_thr, hp_thr = lp, None
-
-    cleaned_img = image.clean_img(
-        bold_path,
-        detrend=False,
-        standardize=False,
-        t_r=repetition_time,
-        ensure_finite=True,
-        low_pass=lp_thr,
-        high_pass=hp_thr,
+    import numpy as np
+    from oscprep.interfaces.pca_denoise import _intensity_mask, _voxel_chunks
+    from oscprep.utils.nifti_io import Nifti4DWriter, open_nifti_memmap
+
+    img, data, scratch_file = open_nifti_memmap(bold_path)
+    n_tps = img.shape[-1]
+    voxels = data.reshape(-1, n_tps, order="F")
+    slope, inter = float(img.dataobj.slope), float(img.dataobj.inter)
+    # the float64 filter temporaries take several copies of a chunk
+    chunks = _voxel_chunks(len(voxels), n_tps, mem_budget_gb / 4)
+
+    def _read_chunk(i0, i1):
+        chunk = np.asarray(voxels[i0:i1], dtype=np.float32) * np.float32(slope)
+        chunk += np.float32(inter)
+        # ensure_finite
+        chunk[~np.isfinite(chunk)] = 0
+
+        return chunk
+
+    mask_rows = None
+    if mask_path is not None:
+        mask = np.asanyarray(nib.load(mask_path).dataobj) > 0
+        assert (
+            mask.shape[:3] == img.shape[:3]
+        ), f"mask shape {mask.shape} does not match bold shape {img.shape}."
+        mask_rows = mask.reshape(-1, order="F")
+    elif auto_mask:
+        mean_img = np.concatenate(
+            [_read_chunk(i0, i1).mean(axis=1) for i0, i1 in chunks]
+        )
+        mask_rows = _intensity_mask(mean_img.reshape(img.shape[:3], order="F")).reshape(
+            -1, order="F"
+        )
+
+    writer = Nifti4DWriter(
+        outfile,
+        img.shape,
+        img.affine,
+        header=img.header,
+        repetition_time=repetition_time,
     )
+    for i0, i1 in chunks:
+        chunk = _read_chunk(i0, i1)
+        if mask_rows is None:
+            chunk = _lowpass_filter(chunk, repetition_time, lp)
+        elif mask_rows[i0:i1].any():
+            rows = mask_rows[i0:i1]
+            chunk[rows] = _lowpass_filter(chunk[rows], repetition_time, lp)
+        writer.write_voxels(i0, chunk)
+    writer.close()
 
-    save_bold = "proc-lp_bold.nii.gz"
-    nib.save(cleaned_img, save_bold)
+    del voxels, data
+    if scratch_file is not None:
+        os.remove(scratch_file)
 
 
 class LowPassFilterBoldInputSpec(TraitedSpec):
@@ -35,6 +132,21 @@ class LowPassFilterBoldInputSpec(TraitedSpec):
     low_pass_threshold = traits.Float(
         desc="lowpass filtering threshold", mandatory=True
     )
+    mask_path = File(
+        exists=True,
+        desc="voxels outside of the mask are not filtered (overrides `auto_mask`)",
+    )
+    auto_mask = traits.Bool(
+        False,
+        usedefault=True,
+        desc="restrict filtering to an intensity mask of the mean bold image",
+    )
+    mem_budget_gb = traits.Float(
+        1.0,
+        usedefault=True,
+        nohash=True,
+        desc="memory budget (GB) of the chunked filter",
+    )
 
 
 class LowPassFilterBoldOutputSpec(TraitedSpec):
@@ -52,13 +164,17 @@ class LowPassFilterBold(SimpleInterface):
             self.inputs.bold_path,
             self.inputs.repetition_time,
             lp=self.inputs.low_pass_threshold,
+            mask_path=(
+                self.inputs.mask_path if isdefined(self.inputs.mask_path) else None
+            ),
+            auto_mask=self.inputs.auto_mask,
+            mem_budget_gb=self.inputs.mem_budget_gb,
         )
 
         return runtime
 
     def _list_outputs(self):
         outputs = self._outputs().get()
-        outfile = "proc-lp_bold.nii.gz"
-        outputs["lp_bold_path"] = os.path.abspath(outfile)
+        outputs["lp_bold_path"] = os.path.abspath(LP_BOLD_BASE)
 
         return outputs
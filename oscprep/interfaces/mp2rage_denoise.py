@@ -2,6 +2,7 @@ from nipype.interfaces.base import (
     File,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
 
@@ -9,97 +10,209 @@ import nibabel as nb
 import numpy as np
 import os
 
+SWEEP_BASE = "mp2rage_denoised_sweep.nii.gz"
+SWEEP_METRICS_BASE = "mp2rage_denoised_sweep.tsv"
+
 
 def MP2RAGErobustfunc(INV1, INV2, beta):
     return (np.conj(INV1) * INV2 - beta) / (INV1**2 + INV2**2 + 2 * beta)
 
 
-def rootsquares_pos(a, b, c):
-    return (-b + np.sqrt(b**2 - 4 * a * c)) / (2 * a)
+def _load_volume(img):
+    """
+    Load the data of `img` as `get_fdata` does (float64), keeping it as
+    float32 when that is lossless (e.g. integer or float32 data on disk)
+    """
 
+    data = np.asanyarray(img.dataobj, dtype=np.float64)
+    data_f32 = data.astype(np.float32)
+    if np.array_equal(data_f32, data, equal_nan=True):
+        return data_f32
 
-def rootsquares_neg(a, b, c):
-    return (-b - np.sqrt(b**2 - 4 * a * c)) / (2 * a)
+    return data
 
 
-def _MP2RAGEdenoise(mp2rage_path, inv1_path, inv2_path, factor):
+def _mp2rage_denoise_slab(MP2RAGE, INV1, INV2, betas, mp2rage_max=None):
     """
-    Creates a denoised MP2RAGE nibabel Nifti1Image, `new_MP2RAGEimg`
-    Uses the same affine and header information as `mp2rage_path`
+    Robust MP2RAGE combination (O'Brien et al., 2014) on a z-slab: INV1 is
+    re-estimated as the root of the MP2RAGE equation closest to its
+    polarity-corrected value, once per voxel, and shared by the robust
+    combinations of every regularization `betas`. Computed in float64 so
+    the int16 results do not depend on the slab size.
+    `mp2rage_max` is the maximum of the positive-valued MP2RAGE volume
+    (integer format), or None.
+
+    Returns an int16 array (len(betas), *slab shape)
     """
 
-    MP2RAGEimg = nb.load(mp2rage_path)
-    INV1img = nb.load(inv1_path)
-    INV2img = nb.load(inv2_path)
-
-    MP2RAGEimg_img = MP2RAGEimg.get_fdata()
-    INV1img_img = INV1img.get_fdata()
-    INV2img_img = INV2img.get_fdata()
-
-    if MP2RAGEimg_img.min() >= 0 and MP2RAGEimg_img.max() >= 0.51:
-        # converts MP2RAGE to -0.5 to 0.5 scale - assumes that it is getting only positive values
-        MP2RAGEimg_img = (
-            MP2RAGEimg_img - MP2RAGEimg_img.max() / 2
-        ) / MP2RAGEimg_img.max()
-        integerformat = 1
-    else:
-        integerformat = 0
-
-    # computes correct INV1 dataset
-    # gives the correct polarity to INV1
-    INV1img_img = np.sign(MP2RAGEimg_img) * INV1img_img
-
-    # because the MP2RAGE INV1 and INV2 is a sum of squares data, while the
-    # MP2RAGEimg is a phase sensitive coil combination.. some more maths has to
-    # be performed to get a better INV1 estimate which here is done by assuming
-    # both INV2 is closer to a real phase sensitive combination
-
-    # INV1pos=rootsquares_pos(-MP2RAGEimg.img,INV2img.img,-INV2img.img.^2.*MP2RAGEimg.img);
-    INV1pos = rootsquares_pos(
-        -MP2RAGEimg_img,
-        INV2img_img,
-        -(INV2img_img**2) * MP2RAGEimg_img,
-    )
-    INV1neg = rootsquares_neg(
-        -MP2RAGEimg_img,
-        INV2img_img,
-        -(INV2img_img**2) * MP2RAGEimg_img,
+    MP2RAGE = MP2RAGE.astype(np.float64)
+    INV1 = INV1.astype(np.float64)
+    INV2 = INV2.astype(np.float64)
+
+    if mp2rage_max is not None:
+        MP2RAGE = (MP2RAGE - mp2rage_max / 2) / mp2rage_max
+
+    INV1 *= np.sign(MP2RAGE)
+
+    # roots of a * INV1**2 + INV2 * INV1 + c = 0
+    a = -MP2RAGE
+    c = -(INV2**2) * MP2RAGE
+    sqrt_disc = np.sqrt(INV2**2 - 4 * a * c)
+    del c
+    a *= 2
+    INV1pos = (-INV2 + sqrt_disc) / a
+    INV1neg = (-INV2 - sqrt_disc) / a
+    del a, sqrt_disc
+
+    # closest root to the polarity-corrected INV1 (voxels where neither
+    # comparison holds, e.g. NaNs, keep INV1)
+    dist_pos = np.absolute(INV1 - INV1pos)
+    dist_neg = np.absolute(INV1 - INV1neg)
+    INV1final = np.where(
+        dist_pos > dist_neg,
+        INV1neg,
+        np.where(dist_pos <= dist_neg, INV1pos, INV1),
     )
+    del dist_pos, dist_neg, INV1pos, INV1neg, INV1
 
-    INV1final = INV1img_img
-
-    INV1final[
-        np.absolute(INV1img_img - INV1pos) > np.absolute(INV1img_img - INV1neg)
-    ] = INV1neg[np.absolute(INV1img_img - INV1pos) > np.absolute(INV1img_img - INV1neg)]
-    INV1final[
-        np.absolute(INV1img_img - INV1pos) <= np.absolute(INV1img_img - INV1neg)
-    ] = INV1pos[
-        np.absolute(INV1img_img - INV1pos) <= np.absolute(INV1img_img - INV1neg)
-    ]
-
-    # usually the multiplicative factor shouldn't be greater then 10, but that
-    # is not the ase when the image is bias field corrected, in which case the
-    # noise estimated at the edge of the imagemight not be such a good measure
-    multiplyingFactor = factor
-    noiselevel = multiplyingFactor * np.mean(INV2img_img[:, -11:, -11:])
-
-    # % MP2RAGEimgRobustScanner = MP2RAGErobustfunc(INV1img.img, INV2img.img, noiselevel. ^ 2)
-    MP2RAGEimgRobustPhaseSensitive = MP2RAGErobustfunc(
-        INV1final, INV2img_img, noiselevel**2
+    out = np.empty((len(betas),) + INV1final.shape, dtype=np.int16)
+    for idx, beta in enumerate(betas):
+        robust = MP2RAGErobustfunc(INV1final, INV2, beta)
+        if mp2rage_max is not None:
+            robust = np.round(4095 * (robust + 0.5))
+        out[idx] = nb.casting.float_to_int(robust, "int16")
+
+    return out
+
+
+def _mp2rage_denoise_volumes(
+    mp2rage_data, inv1_data, inv2_data, factors, slab_size=16, n_threads=1
+):
+    """
+    Denoise an MP2RAGE volume for each of `factors` over z-slabs of
+    `slab_size` slices, optionally over `n_threads` threads.
+
+    Returns an int16 array (len(factors), x, y, z)
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    mp2rage_max = None
+    if mp2rage_data.min() >= 0 and mp2rage_data.max() >= 0.51:
+        # integer format, converted to a -0.5 to 0.5 scale in the kernel
+        mp2rage_max = np.float64(mp2rage_data.max())
+
+    noise_mean = np.mean(inv2_data[:, -11:, -11:].astype(np.float64, order="K"))
+    betas = [(factor * noise_mean) ** 2 for factor in factors]
+
+    out = np.empty((len(factors),) + mp2rage_data.shape, dtype=np.int16)
+    n_slices = mp2rage_data.shape[2]
+
+    def _denoise_slab(z0):
+        z = slice(z0, min(z0 + slab_size, n_slices))
+        out[..., z] = _mp2rage_denoise_slab(
+            mp2rage_data[:, :, z],
+            inv1_data[:, :, z],
+            inv2_data[:, :, z],
+            betas,
+            mp2rage_max=mp2rage_max,
+        )
+
+    # numpy releases the GIL, slabs are written to disjoint slices
+    with ThreadPoolExecutor(max_workers=max(n_threads, 1)) as executor:
+        list(executor.map(_denoise_slab, range(0, n_slices, slab_size)))
+
+    return out
+
+
+def _MP2RAGEdenoiseChunked(
+    mp2rage_path, inv1_path, inv2_path, factor, slab_size=16, n_threads=1
+):
+    """
+    Creates a denoised MP2RAGE nibabel Nifti1Image, with the affine and
+    header of `mp2rage_path`. Inputs are held in float32 when lossless and
+    the denoising is computed over z-slabs of `slab_size` slices,
+    optionally over `n_threads` threads.
+    """
+
+    MP2RAGEimg = nb.load(mp2rage_path)
+    out = _mp2rage_denoise_volumes(
+        _load_volume(MP2RAGEimg),
+        _load_volume(nb.load(inv1_path)),
+        _load_volume(nb.load(inv2_path)),
+        [factor],
+        slab_size=slab_size,
+        n_threads=n_threads,
     )
 
-    if integerformat == 0:
-        MP2RAGEimg_img = MP2RAGEimgRobustPhaseSensitive
-    else:
-        MP2RAGEimg_img = np.round(4095 * (MP2RAGEimgRobustPhaseSensitive + 0.5))
+    return nb.Nifti1Image(out[0], MP2RAGEimg.affine, MP2RAGEimg.header)
+
+
+def _MP2RAGEdenoiseSweep(
+    mp2rage_path,
+    inv1_path,
+    inv2_path,
+    factor,
+    factors,
+    slab_size=16,
+    n_threads=1,
+    out_file=SWEEP_BASE,
+    metrics_file=SWEEP_METRICS_BASE,
+):
+    """
+    Denoise an MP2RAGE image with `factor` and each of `factors` in one
+    pass, sharing the INV1 root selection. The `factors` sweep is saved as
+    a 4D image (one volume per factor) with a tsv of metrics per factor:
+        `background_std`: standard deviation of the denoised image in the
+            background (INV2 below twice the noise level estimated from
+            its corner), lower is cleaner
+        `foreground_bias`: mean absolute change of the foreground (other
+            voxels) from the input MP2RAGE, lower preserves more contrast
+
+    Returns the image denoised with `factor`, as `_MP2RAGEdenoiseChunked`
+    """
+
+    all_factors = list(factors)
+    if factor not in all_factors:
+        all_factors.append(factor)
 
-    # Save image
-    MP2RAGEimg_img = nb.casting.float_to_int(MP2RAGEimg_img, "int16")
-    new_MP2RAGEimg = nb.Nifti1Image(
-        MP2RAGEimg_img, MP2RAGEimg.affine, MP2RAGEimg.header
+    MP2RAGEimg = nb.load(mp2rage_path)
+    mp2rage_data = _load_volume(MP2RAGEimg)
+    inv2_data = _load_volume(nb.load(inv2_path))
+    out = _mp2rage_denoise_volumes(
+        mp2rage_data,
+        _load_volume(nb.load(inv1_path)),
+        inv2_data,
+        all_factors,
+        slab_size=slab_size,
+        n_threads=n_threads,
+    )
+
+    background = inv2_data < 2 * np.mean(
+        inv2_data[:, -11:, -11:].astype(np.float64, order="K")
+    )
+    with open(metrics_file, "w") as f:
+        f.write("factor\tbackground_std\tforeground_bias\n")
+        for factor_sweep, denoised in zip(factors, out):
+            background_std = denoised[background].astype(np.float64).std()
+            foreground_bias = np.mean(
+                np.absolute(
+                    denoised[~background].astype(np.float64) - mp2rage_data[~background]
+                )
+            )
+            f.write(f"{factor_sweep}\t{background_std:.4f}\t{foreground_bias:.4f}\n")
+
+    header = MP2RAGEimg.header.copy()
+    header.set_data_dtype(np.int16)
+    nb.save(
+        nb.Nifti1Image(
+            np.moveaxis(out[: len(factors)], 0, -1), MP2RAGEimg.affine, header
+        ),
+        out_file,
     )
 
-    return new_MP2RAGEimg
+    return nb.Nifti1Image(
+        out[all_factors.index(factor)], MP2RAGEimg.affine, MP2RAGEimg.header
+    )
 
 
 class Mp2rageDenoiseInputSpec(TraitedSpec):
@@ -107,10 +220,22 @@ class Mp2rageDenoiseInputSpec(TraitedSpec):
     inv1 = File(exists=True, desc="inv1 path", mandatory=True)
     inv2 = File(exists=True, desc="inv2 path", mandatory=True)
     factor = traits.Int(desc="denoising regularization factor", mandatory=True)
+    factors = traits.List(
+        traits.Int,
+        desc=(
+            "sweep of denoising regularization factors, denoised in the same"
+            " pass as `factor` into a 4D image with background noise metrics"
+        ),
+    )
+    num_threads = traits.Int(1, usedefault=True, nohash=True, desc="number of threads")
 
 
 class Mp2rageDenoiseOutputSpec(TraitedSpec):
     mp2rage_denoised_path = File(exists=True, desc="mp2rage denoised path")
+    mp2rage_denoised_sweep = File(
+        desc="4D mp2rage denoised with each of `factors` (volume per factor)"
+    )
+    sweep_metrics = File(desc="tsv of background noise metrics per factor")
 
 
 class Mp2rageDenoise(SimpleInterface):
@@ -122,12 +247,25 @@ class Mp2rageDenoise(SimpleInterface):
     output_spec = Mp2rageDenoiseOutputSpec
 
     def _run_interface(self, runtime):
-        mp2ragedenoise_img = _MP2RAGEdenoise(
-            self.inputs.mp2rage,
-            self.inputs.inv1,
-            self.inputs.inv2,
-            self.inputs.factor,
-        )
+        if isdefined(self.inputs.factors) and self.inputs.factors:
+            mp2ragedenoise_img = _MP2RAGEdenoiseSweep(
+                self.inputs.mp2rage,
+                self.inputs.inv1,
+                self.inputs.inv2,
+                self.inputs.factor,
+                self.inputs.factors,
+                n_threads=self.inputs.num_threads,
+                out_file=SWEEP_BASE,
+                metrics_file=SWEEP_METRICS_BASE,
+            )
+        else:
+            mp2ragedenoise_img = _MP2RAGEdenoiseChunked(
+                self.inputs.mp2rage,
+                self.inputs.inv1,
+                self.inputs.inv2,
+                self.inputs.factor,
+                n_threads=self.inputs.num_threads,
+            )
         outfile = "mp2rage_denoised.nii.gz"
         nb.save(mp2ragedenoise_img, outfile)
 
@@ -137,5 +275,8 @@ class Mp2rageDenoise(SimpleInterface):
         outputs = self._outputs().get()
         outfile = "mp2rage_denoised.nii.gz"
         outputs["mp2rage_denoised_path"] = os.path.abspath(outfile)
+        if isdefined(self.inputs.factors) and self.inputs.factors:
+            outputs["mp2rage_denoised_sweep"] = os.path.abspath(SWEEP_BASE)
+            outputs["sweep_metrics"] = os.path.abspath(SWEEP_METRICS_BASE)
 
         return outputs
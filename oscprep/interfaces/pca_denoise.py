@@ -1,44 +1,512 @@
 from nipype.interfaces.base import (
+    Directory,
     File,
     SimpleInterface,
     TraitedSpec,
+    isdefined,
     traits,
 )
 
 import os
 
+PCA_DENOISE_BASE = "mppca.nii.gz"
 
-def _PCADenoise(bold_path, n_components=10, outfile="mppca.nii.gz"):
+
+def _standardize(data):
+    """
+    Standardize every timepoint (column) of `data` (n_voxels, n_tps)
+    in-place, as `sklearn.preprocessing.StandardScaler` does, and return
+    the column means and scales
+    """
+    import numpy as np
+
+    mean = data.mean(axis=0, dtype=np.float64)
+    scale = data.std(axis=0, dtype=np.float64)
+    scale[scale == 0] = 1.0
+    data -= mean.astype(data.dtype)
+    data /= scale.astype(data.dtype)
+
+    return mean, scale
+
+
+def _pca_components(data, n_components, solver="gram"):
+    """
+    Return the leading `n_components` principal axes (n_tps, n_components)
+    of the column-centred `data` (n_voxels, n_tps).
+
+    `gram` eigendecomposes the small (n_tps, n_tps) Gram matrix,
+    `randomized` runs a randomized SVD of `data` (cheaper when n_tps is
+    in the thousands).
+    """
+    import numpy as np
+
+    n_components = min(n_components, *data.shape)
+    if solver == "randomized":
+        from sklearn.utils.extmath import randomized_svd
+
+        _, _, vt = randomized_svd(data, n_components, random_state=0)
+
+        return vt.T.astype(data.dtype)
+
+    gram = (data.T @ data).astype(np.float64)
+    _, eigvecs = np.linalg.eigh(gram)
+
+    return eigvecs[:, ::-1][:, :n_components].astype(data.dtype)
+
+
+def _pca_reconstruct(data, n_components=10, solver="gram"):
+    """
+    Standardize `data` (n_voxels, n_tps) per timepoint, project it onto
+    its leading `n_components` principal axes and return the
+    reconstruction on the original scale. `data` is overwritten.
+    """
+    import numpy as np
+
+    mean, scale = _standardize(data)
+    components = _pca_components(data, n_components, solver=solver)
+    data[:] = (data @ components) @ components.T
+    data *= scale.astype(data.dtype)
+    data += mean.astype(data.dtype)
+
+    return data
+
+
+def _mp_noise_components(eigvals, n_voxels):
+    """
+    Return the number of noise components among the ascending covariance
+    eigenvalues `eigvals` of a patch with `n_voxels` voxels, following the
+    Marchenko-Pastur classifier of Veraart et al. (2016)
+    """
+    import numpy as np
+
+    # centring over the voxels leaves at most n_voxels - 1 non-zero
+    # eigenvalues, the dropped (null) eigenvalues are noise components
+    n_dropped = max(eigvals.size - (n_voxels - 1), 0)
+    eigvals = eigvals[n_dropped:]
+    var = np.mean(eigvals)
+    c = eigvals.size - 1
+    r = eigvals[c] - eigvals[0] - 4 * np.sqrt((c + 1.0) / n_voxels) * var
+    while r > 0 and c > 0:
+        var = np.mean(eigvals[:c])
+        c = c - 1
+        r = eigvals[c] - eigvals[0] - 4 * np.sqrt((c + 1.0) / n_voxels) * var
+
+    return c + 1 + n_dropped
+
+
+def _mppca_patches(patches):
+    """
+    MP-PCA denoise a batch of patches (n_patches, n_voxels, n_tps).
+    Returns the denoised patches and the number of signal components
+    kept in every patch.
+    """
+    import numpy as np
+
+    n_voxels, n_tps = patches.shape[1:]
+    mean = patches.mean(axis=1, keepdims=True)
+    centered = patches - mean
+    # eigendecomposition of the smaller of the two Gram matrices
+    by_voxel = n_voxels <= n_tps
+    if by_voxel:
+        gram = centered @ centered.transpose(0, 2, 1)
+    else:
+        gram = centered.transpose(0, 2, 1) @ centered
+    eigvals, eigvecs = np.linalg.eigh(gram.astype(np.float64))
+    eigvals = np.clip(eigvals, 0, None) / n_voxels
+
+    denoised = np.empty_like(patches)
+    n_signal = np.empty(len(patches), dtype=np.int64)
+    for ix in range(len(patches)):
+        n_noise = _mp_noise_components(eigvals[ix], n_voxels)
+        n_signal[ix] = eigvals.shape[1] - min(n_noise, eigvals.shape[1])
+        basis = eigvecs[ix][:, eigvals.shape[1] - n_signal[ix] :].astype(patches.dtype)
+        if by_voxel:
+            denoised[ix] = basis @ (basis.T @ centered[ix])
+        else:
+            denoised[ix] = (centered[ix] @ basis) @ basis.T
+    denoised += mean
+
+    return denoised, n_signal
+
+
+def _patch_starts(dim, patch_radius, stride):
+    """
+    Return the first index of every patch along an axis of length `dim`,
+    covering every index at least once
+    """
+    import numpy as np
+
+    width = min(2 * patch_radius + 1, dim)
+    starts = np.arange(0, dim - width + 1, stride)
+    if starts[-1] != dim - width:
+        starts = np.append(starts, dim - width)
+
+    return starts, width
+
+
+def _mppca_slab_task(task):
+    """
+    MP-PCA denoise every patch of a slab of data (x, y, z, t), which is
+    one patch wide along z. Returns the weighted sum of the denoised
+    patches and the weights, for overlap averaging.
+    """
+    import numpy as np
+
+    slab, mask, patch_radius, stride = task
+    accum = np.zeros_like(slab)
+    weights = np.zeros(slab.shape[:3], dtype=slab.dtype)
+    x_starts, x_width = _patch_starts(slab.shape[0], patch_radius, stride)
+    y_starts, y_width = _patch_starts(slab.shape[1], patch_radius, stride)
+
+    for y0 in y_starts:
+        # patches without any voxel in the mask are skipped
+        row_starts = [
+            x0
+            for x0 in x_starts
+            if mask is None or mask[x0 : x0 + x_width, y0 : y0 + y_width].any()
+        ]
+        if not row_starts:
+            continue
+        # one row of patches at a time bounds the memory of the batch
+        patches = np.stack(
+            [
+                slab[x0 : x0 + x_width, y0 : y0 + y_width].reshape(-1, slab.shape[-1])
+                for x0 in row_starts
+            ]
+        )
+        denoised, n_signal = _mppca_patches(patches)
+        # patches with fewer signal components are weighted higher
+        theta = (1.0 / (1.0 + n_signal)).astype(slab.dtype)
+        for x0, patch, w in zip(row_starts, denoised, theta):
+            accum[x0 : x0 + x_width, y0 : y0 + y_width] += w * patch.reshape(
+                x_width, y_width, *slab.shape[2:]
+            )
+            weights[x0 : x0 + x_width, y0 : y0 + y_width] += w
+
+    return accum, weights
+
+
+def _local_mppca(data, patch_radius=2, stride=None, mask=None, n_procs=1):
+    """
+    Denoise `data` (x, y, z, t) with MP-PCA on overlapping local patches
+    of (2 * `patch_radius` + 1)^3 voxels placed every `stride` voxels.
+    Slabs of patches are distributed over `n_procs` processes and
+    overlapping patch estimates are averaged. Voxels outside of `mask`
+    keep their original values.
+    """
+    import numpy as np
+    from oscprep.utils.parallel import imap_ordered
+
+    stride = patch_radius if stride is None else stride
+    stride = max(stride, 1)
+    z_starts, z_width = _patch_starts(data.shape[2], patch_radius, stride)
+
+    accum = np.zeros_like(data)
+    weights = np.zeros(data.shape[:3], dtype=data.dtype)
+    tasks = (
+        (
+            data[:, :, z0 : z0 + z_width],
+            None if mask is None else mask[:, :, z0 : z0 + z_width],
+            patch_radius,
+            stride,
+        )
+        for z0 in z_starts
+    )
+    for z0, (slab_accum, slab_weights) in zip(
+        z_starts, imap_ordered(_mppca_slab_task, tasks, n_procs=n_procs)
+    ):
+        accum[:, :, z0 : z0 + z_width] += slab_accum
+        weights[:, :, z0 : z0 + z_width] += slab_weights
+
+    denoised = weights > 0
+    if mask is not None:
+        denoised &= mask
+    accum[denoised] /= weights[denoised][:, None]
+    accum[~denoised] = data[~denoised]
+
+    return accum
+
+
+def _voxel_chunks(n_voxels, n_tps, mem_budget_gb):
+    """
+    Split `n_voxels` into chunks whose working set (input, standardized
+    and reconstructed float32 copies and a float64 product) fits within
+    `mem_budget_gb`
+    """
+    bytes_per_voxel = n_tps * (3 * 4 + 8)
+    chunk_size = max(int(mem_budget_gb * 1024**3 // bytes_per_voxel), 1)
+
+    return [
+        (i0, min(i0 + chunk_size, n_voxels)) for i0 in range(0, n_voxels, chunk_size)
+    ]
+
+
+def _PCADenoiseOutOfCore(
+    bold_path,
+    n_components=10,
+    mem_budget_gb=1.0,
+    mask_path=None,
+    auto_mask=False,
+    outfile=PCA_DENOISE_BASE,
+):
+    """
+    Global PCA denoising of a bold series that is never fully loaded:
+    the (uncompressed) series is memory-mapped, timepoint statistics and
+    the Gram matrix are accumulated over voxel chunks, and the
+    reconstruction is streamed chunk by chunk to the output.
+    """
     import nibabel as nib
-    from sklearn.decomposition import PCA
-    from sklearn.preprocessing import StandardScaler
+    import numpy as np
+    from oscprep.utils.nifti_io import Nifti4DWriter, open_nifti_memmap
 
-    img = nib.load(bold_path)
-    data = img.get_fdata()
+    img, data, scratch_file = open_nifti_memmap(bold_path)
+    n_tps = img.shape[-1]
+    voxels = data.reshape(-1, n_tps, order="F")
+    slope, inter = float(img.dataobj.slope), float(img.dataobj.inter)
+
+    mask_rows = None
+    if mask_path is not None:
+        mask = np.asanyarray(nib.load(mask_path).dataobj) > 0
+        assert (
+            mask.shape[:3] == img.shape[:3]
+        ), f"mask shape {mask.shape} does not match bold shape {img.shape}."
+        mask_rows = mask.reshape(-1, order="F")
+    chunks = _voxel_chunks(len(voxels), n_tps, mem_budget_gb)
+    if mask_rows is None and auto_mask:
+        mean_img = np.concatenate(
+            [
+                voxels[i0:i1].mean(axis=1, dtype=np.float64) * slope + inter
+                for i0, i1 in chunks
+            ]
+        )
+        mask_rows = _intensity_mask(mean_img.reshape(img.shape[:3], order="F")).reshape(
+            -1, order="F"
+        )
+
+    def _read_chunk(i0, i1):
+        chunk = np.asarray(voxels[i0:i1], dtype=np.float32) * np.float32(slope)
+        chunk += np.float32(inter)
+        if mask_rows is None:
+            return chunk, None
+        return chunk, mask_rows[i0:i1]
+
+    # Pass 1: timepoint means
+    n_samples, col_sum = 0, np.zeros(n_tps)
+    for i0, i1 in chunks:
+        chunk, rows = _read_chunk(i0, i1)
+        if rows is not None:
+            chunk = chunk[rows]
+        n_samples += len(chunk)
+        col_sum += chunk.sum(axis=0, dtype=np.float64)
+    mean32 = (col_sum / n_samples).astype(np.float32)
+
+    # Pass 2: Gram matrix of the centred data, its diagonal gives the
+    # timepoint scales (StandardScaler) of the standardized Gram matrix
+    gram = np.zeros((n_tps, n_tps))
+    for i0, i1 in chunks:
+        chunk, rows = _read_chunk(i0, i1)
+        if rows is not None:
+            chunk = chunk[rows]
+        chunk -= mean32
+        gram += chunk.T @ chunk
+    scale = np.sqrt(np.diag(gram) / n_samples)
+    scale[scale == 0] = 1.0
+    scale32 = scale.astype(np.float32)
+    gram /= np.outer(scale, scale)
+    _, eigvecs = np.linalg.eigh(gram)
+    components = eigvecs[:, ::-1][:, : min(n_components, n_tps)].astype(np.float32)
+
+    # Pass 3: streamed reconstruction
+    header = img.header.copy()
+    writer = Nifti4DWriter(
+        outfile,
+        img.shape,
+        img.affine,
+        header=header,
+        repetition_time=header.get_zooms()[3],
+    )
+    for i0, i1 in chunks:
+        chunk, rows = _read_chunk(i0, i1)
+        denoised = chunk if rows is None else chunk[rows]
+        denoised -= mean32
+        denoised /= scale32
+        denoised = (denoised @ components) @ components.T
+        denoised *= scale32
+        denoised += mean32
+        if rows is None:
+            chunk = denoised
+        else:
+            chunk[rows] = denoised
+        writer.write_voxels(i0, chunk)
+    writer.close()
+
+    del voxels, data
+    if scratch_file is not None:
+        os.remove(scratch_file)
+
+
+def _intensity_mask(mean, fraction=0.15):
+    """
+    Cheap foreground mask from the temporal `mean` (x, y, z) of a bold
+    series: voxels exceeding `fraction` of the robust (98th percentile)
+    maximum
+    """
+    import numpy as np
+    from scipy.ndimage import binary_fill_holes
+
+    mask = mean > fraction * np.percentile(mean, 98)
+
+    return binary_fill_holes(mask)
+
+
+def _pca_denoise_data(
+    data,
+    n_components=10,
+    solver="gram",
+    method="global",
+    patch_radius=2,
+    n_procs=1,
+    mask=None,
+):
+    """
+    PCA denoise an in-memory float32 bold series `data` (x, y, z, t). Only
+    voxels within `mask` are denoised, other voxels are passed through.
+    """
     x, y, z, n_tps = data.shape
-    data_reshaped = data.reshape(-1, n_tps)
-    # standardize the data
-    scaler = StandardScaler()
-    data_scaled = scaler.fit_transform(data_reshaped)
-    # Apply MPPCA using PCA
-    num_components = n_components  # Number of principal components
-    pca = PCA(n_components=num_components)
-    data_mppca = pca.fit_transform(data_scaled)
-    # Inverse transform to reconstruct the data
-    data_reconstructed = pca.inverse_transform(data_mppca)
-    data_reconstructed = scaler.inverse_transform(data_reconstructed)
+
+    if method == "local":
+        return _local_mppca(data, patch_radius=patch_radius, mask=mask, n_procs=n_procs)
+
+    # voxels are independent samples, flatten without copying
+    data_2d = data.reshape(-1, n_tps, order="F")
+    if mask is None:
+        _pca_reconstruct(data_2d, n_components=n_components, solver=solver)
+    else:
+        mask_rows = mask.reshape(-1, order="F")
+        data_2d[mask_rows] = _pca_reconstruct(
+            data_2d[mask_rows], n_components=n_components, solver=solver
+        )
     # Reshape the reconstructed data back to 4D
-    data_reconstructed = data_reconstructed.reshape(x, y, z, n_tps)
+    return data_2d.reshape(x, y, z, n_tps, order="F")
+
+
+def _load_mask(mask_path, shape):
+    import nibabel as nib
+    import numpy as np
+
+    mask = np.asanyarray(nib.load(mask_path).dataobj) > 0
+    assert (
+        mask.shape[:3] == shape[:3]
+    ), f"mask shape {mask.shape} does not match bold shape {shape}."
+
+    return mask.reshape(shape[:3])
+
 
+def _PCADenoise(
+    bold_path,
+    n_components=10,
+    solver="gram",
+    method="global",
+    patch_radius=2,
+    n_procs=1,
+    mask_path=None,
+    auto_mask=False,
+    outfile=PCA_DENOISE_BASE,
+):
+    """
+    PCA denoise a bold series. Only voxels within `mask_path` (or an
+    intensity mask with `auto_mask`) are denoised, other voxels are
+    passed through.
+    """
+    import nibabel as nib
+    import numpy as np
+
+    img = nib.load(bold_path)
+    data = np.asarray(img.dataobj, dtype=np.float32)
+
+    mask = None
+    if mask_path is not None:
+        mask = _load_mask(mask_path, data.shape)
+    elif auto_mask:
+        mask = _intensity_mask(data.mean(axis=-1))
+
+    data_reconstructed = _pca_denoise_data(
+        data,
+        n_components=n_components,
+        solver=solver,
+        method=method,
+        patch_radius=patch_radius,
+        n_procs=n_procs,
+        mask=mask,
+    )
+
+    header = img.header.copy()
+    header.set_data_dtype(np.float32)
     nib.save(
-        nib.Nifti1Image(data_reconstructed, affine=img.affine, header=img.header),
+        nib.Nifti1Image(data_reconstructed, affine=img.affine, header=header),
         outfile,
     )
 
 
 class PCADenoiseInputSpec(TraitedSpec):
     bold_path = File(exists=True, desc="bold path", mandatory=True)
-    n_components = traits.Int(desc="number of PCA components", mandatory=False)
+    n_components = traits.Int(
+        10, usedefault=True, desc="number of PCA components", mandatory=False
+    )
+    solver = traits.Enum(
+        "gram",
+        "randomized",
+        usedefault=True,
+        desc="eigendecomposition of the timepoint Gram matrix or randomized SVD",
+    )
+    method = traits.Enum(
+        "global",
+        "local",
+        usedefault=True,
+        desc=(
+            "`global` PCA over all voxels with `n_components` components, or"
+            " `local` MP-PCA on overlapping patches with Marchenko-Pastur"
+            " component selection"
+        ),
+    )
+    patch_radius = traits.Int(
+        2, usedefault=True, desc="local MP-PCA patch radius (voxels)"
+    )
+    mask_path = File(
+        exists=True,
+        desc="voxels outside of the mask are not denoised (overrides `auto_mask`)",
+    )
+    auto_mask = traits.Bool(
+        False,
+        usedefault=True,
+        desc="restrict denoising to an intensity mask of the mean bold image",
+    )
+    mem_budget_gb = traits.Float(
+        desc=(
+            "memory budget (GB) of out-of-core global PCA: the bold series is"
+            " memory-mapped and processed in voxel chunks (loaded in memory"
+            " if unset)"
+        ),
+    )
+    cache_dir = Directory(
+        desc=(
+            "content-addressed cache of denoised series, reused for identical"
+            " inputs and parameters"
+        ),
+        nohash=True,
+    )
+    cache_max_gb = traits.Float(
+        20.0,
+        usedefault=True,
+        nohash=True,
+        desc="size cap (GB) of `cache_dir`, least recently used results are evicted",
+    )
+    num_threads = traits.Int(
+        1,
+        usedefault=True,
+        nohash=True,
+        desc="number of processes used to denoise local patches",
+    )
 
 
 class PCADenoiseOutputSpec(TraitedSpec):
@@ -50,13 +518,73 @@ class PCADenoise(SimpleInterface):
     output_spec = PCADenoiseOutputSpec
 
     def _run_interface(self, runtime):
-        _PCADenoise(self.inputs.bold_path)
+        if not isdefined(self.inputs.cache_dir):
+            self._denoise()
+
+            return runtime
+
+        from oscprep.utils.result_cache import (
+            cache_lock,
+            fetch_cached,
+            hash_inputs,
+            prune_cache,
+            store_cached,
+        )
+
+        # results are shared by every node denoising the same series with
+        # the same parameters (e.g. the bold reference and hmc branches)
+        input_files = [self.inputs.bold_path]
+        if isdefined(self.inputs.mask_path):
+            input_files.append(self.inputs.mask_path)
+        params = {
+            "method": self.inputs.method,
+            "auto_mask": self.inputs.auto_mask,
+            "masked": isdefined(self.inputs.mask_path),
+        }
+        if self.inputs.method == "local":
+            params["patch_radius"] = self.inputs.patch_radius
+        else:
+            params["n_components"] = self.inputs.n_components
+            params["solver"] = self.inputs.solver
+        key = f"pca-{hash_inputs(input_files, params)}"
+        out_file = os.path.abspath(PCA_DENOISE_BASE)
+
+        with cache_lock(self.inputs.cache_dir, key):
+            if fetch_cached(self.inputs.cache_dir, key, out_file):
+                print(f"Using cached PCA-denoised bold: {key}")
+            else:
+                self._denoise()
+                store_cached(self.inputs.cache_dir, key, out_file)
+                prune_cache(self.inputs.cache_dir, self.inputs.cache_max_gb)
 
         return runtime
 
+    def _denoise(self):
+        mask_path = None
+        if isdefined(self.inputs.mask_path):
+            mask_path = self.inputs.mask_path
+        if isdefined(self.inputs.mem_budget_gb) and self.inputs.method == "global":
+            _PCADenoiseOutOfCore(
+                self.inputs.bold_path,
+                n_components=self.inputs.n_components,
+                mem_budget_gb=self.inputs.mem_budget_gb,
+                mask_path=mask_path,
+                auto_mask=self.inputs.auto_mask,
+            )
+        else:
+            _PCADenoise(
+                self.inputs.bold_path,
+                n_components=self.inputs.n_components,
+                solver=self.inputs.solver,
+                method=self.inputs.method,
+                patch_radius=self.inputs.patch_radius,
+                n_procs=self.inputs.num_threads,
+                mask_path=mask_path,
+                auto_mask=self.inputs.auto_mask,
+            )
+
     def _list_outputs(self):
         outputs = self._outputs().get()
-        outfile = "mppca.nii.gz"
-        outputs["mppca_path"] = os.path.abspath(outfile)
+        outputs["mppca_path"] = os.path.abspath(PCA_DENOISE_BASE)
 
         return outputs
@@ -0,0 +1,139 @@
+from nipype.interfaces.base import (
+    File,
+    OutputMultiObject,
+    SimpleInterface,
+    TraitedSpec,
+    traits,
+)
+
+import os
+
+RIGID_HMC_BASE = "rigid_hmc"
+
+# Worker state, set once per process by `_init_hmc_worker`
+_ESTIMATOR = None
+
+
+def _init_hmc_worker(reference, vox_to_mm):
+    from oscprep.utils.rigid import RigidEstimator
+
+    global _ESTIMATOR
+    _ESTIMATOR = RigidEstimator(reference, vox_to_mm)
+
+
+def _estimate_volume_task(volume):
+    return _ESTIMATOR.estimate(volume)
+
+
+def _RigidHMC(bold_path, ref_path, n_procs=1, out_base=RIGID_HMC_BASE):
+    """
+    Rigid head-motion correction of a bold series to `ref_path`, with
+    volumes estimated in parallel over `n_procs` processes. Outputs follow
+    MCFLIRT (`save_mats`, `save_plots`, `save_rms`), except for the affines:
+        `{out_base}.npz`: (N, 4, 4) store of the FSL affine of each volume to
+            the reference (see `export_fsl_mats` for the MCFLIRT layout)
+        `{out_base}.par`: rotations (rad) and translations (mm)
+        `{out_base}_abs.rms`, `{out_base}_rel.rms`: RMS displacement to the
+            reference and to the previous volume (n_vols - 1 rows)
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.utils.nifti_io import open_nifti_memmap
+    from oscprep.utils.parallel import imap_ordered
+    from oscprep.utils.rigid import rigid_matrix, rigid_params, rms_deviation
+    from oscprep.utils.transforms import fsl_scaling_matrix, save_hmc_affines
+
+    ref_img = nib.load(ref_path)
+    reference = np.asarray(ref_img.dataobj, dtype=np.float32)
+    reference = reference.reshape(reference.shape[:3])
+    img, data, scratch_file = open_nifti_memmap(bold_path)
+    assert tuple(img.shape[:3]) == reference.shape, (
+        f"reference shape {reference.shape} does not match bold shape" f" {img.shape}."
+    )
+    slope, inter = float(img.dataobj.slope), float(img.dataobj.inter)
+    vox_to_mm = fsl_scaling_matrix(ref_img)
+    center = (vox_to_mm @ np.array([*((np.array(reference.shape) - 1) / 2), 1.0]))[:3]
+
+    n_vols = img.shape[3] if len(img.shape) > 3 else 1
+    volumes = (
+        np.asarray(data[..., ix], dtype=np.float32) * np.float32(slope)
+        + np.float32(inter)
+        for ix in range(n_vols)
+    )
+    mats = []
+    for params in imap_ordered(
+        _estimate_volume_task,
+        volumes,
+        n_procs=n_procs,
+        initializer=_init_hmc_worker,
+        initargs=(reference, vox_to_mm),
+    ):
+        # estimates map reference mm to volume mm, FSL affines the reverse
+        mats.append(np.linalg.inv(rigid_matrix(params, center)))
+    del data
+    if scratch_file is not None:
+        os.remove(scratch_file)
+
+    save_hmc_affines(f"{out_base}.npz", mats, engine="native")
+    np.savetxt(
+        f"{out_base}.par",
+        np.array([rigid_params(mat, center) for mat in mats]),
+        fmt="%.6f",
+        delimiter="  ",
+    )
+    np.savetxt(
+        f"{out_base}_abs.rms",
+        [rms_deviation(mat, np.eye(4), center) for mat in mats],
+        fmt="%.6f",
+    )
+    np.savetxt(
+        f"{out_base}_rel.rms",
+        [rms_deviation(mats[ix], mats[ix - 1], center) for ix in range(1, n_vols)],
+        fmt="%.6f",
+    )
+
+
+class RigidHMCInputSpec(TraitedSpec):
+    in_file = File(exists=True, desc="bold path", mandatory=True)
+    ref_file = File(
+        exists=True, desc="reference volume (on the bold grid)", mandatory=True
+    )
+    num_threads = traits.Int(
+        1,
+        usedefault=True,
+        nohash=True,
+        desc="number of processes used to estimate volumes",
+    )
+
+
+class RigidHMCOutputSpec(TraitedSpec):
+    hmc_affines = File(exists=True, desc="(N, 4, 4) hmc affine store")
+    par_file = File(exists=True, desc="motion parameters (MCFLIRT format)")
+    rms_files = OutputMultiObject(
+        File(exists=True), desc="absolute and relative RMS displacement"
+    )
+
+
+class RigidHMC(SimpleInterface):
+    """
+    In-process rigid head-motion correction, producing the MCFLIRT outputs
+    used by the hmc workflow (without resampling the series)
+    """
+
+    input_spec = RigidHMCInputSpec
+    output_spec = RigidHMCOutputSpec
+
+    def _run_interface(self, runtime):
+        _RigidHMC(
+            self.inputs.in_file,
+            self.inputs.ref_file,
+            n_procs=self.inputs.num_threads,
+        )
+        self._results["hmc_affines"] = os.path.abspath(f"{RIGID_HMC_BASE}.npz")
+        self._results["par_file"] = os.path.abspath(f"{RIGID_HMC_BASE}.par")
+        self._results["rms_files"] = [
+            os.path.abspath(f"{RIGID_HMC_BASE}_abs.rms"),
+            os.path.abspath(f"{RIGID_HMC_BASE}_rel.rms"),
+        ]
+
+        return runtime
@@ -0,0 +1,82 @@
+from nipype.interfaces.base import (
+    File,
+    SimpleInterface,
+    TraitedSpec,
+    traits,
+)
+
+import os
+
+ROBUST_REFERENCE_BASE = "bold_reference.nii.gz"
+
+
+def _RobustReference(
+    in_file, n_vols=10, start_vol=0, n_iter=2, outfile=ROBUST_REFERENCE_BASE
+):
+    """
+    Reference image of a bold series: the median of `n_vols` volumes
+    (from `start_vol`) rigidly aligned to their median. Only these volumes
+    are read (array proxy slicing).
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.utils.rigid import RigidEstimator
+    from oscprep.utils.transforms import fsl_scaling_matrix
+
+    img = nib.load(in_file)
+    n_tps = img.shape[3] if len(img.shape) > 3 else 1
+    assert 0 <= start_vol < n_tps, f"volume {start_vol} out of range for {n_tps}."
+    stop_vol = min(start_vol + n_vols, n_tps)
+    if len(img.shape) > 3:
+        window = np.asarray(img.dataobj[..., start_vol:stop_vol], dtype=np.float32)
+    else:
+        window = np.asarray(img.dataobj, dtype=np.float32)[..., np.newaxis]
+
+    reference = np.median(window, axis=-1)
+    if window.shape[-1] > 1:
+        vox_to_mm = fsl_scaling_matrix(img)
+        for _ in range(n_iter):
+            estimator = RigidEstimator(reference, vox_to_mm)
+            aligned = np.empty_like(window)
+            for idx in range(window.shape[-1]):
+                params = estimator.estimate(window[..., idx])
+                aligned[..., idx] = estimator.resample(window[..., idx], params)
+            reference = np.median(aligned, axis=-1)
+
+    header = img.header.copy()
+    header.set_data_dtype(np.float32)
+    nib.save(nib.Nifti1Image(reference.astype(np.float32), img.affine, header), outfile)
+
+
+class RobustReferenceInputSpec(TraitedSpec):
+    in_file = File(exists=True, desc="4D bold image", mandatory=True)
+    n_vols = traits.Int(10, usedefault=True, desc="number of volumes")
+    start_vol = traits.Int(0, usedefault=True, desc="index of the first volume")
+
+
+class RobustReferenceOutputSpec(TraitedSpec):
+    out_file = File(exists=True, desc="bold reference")
+
+
+class RobustReference(SimpleInterface):
+    """
+    Median of a few rigidly realigned bold volumes
+    """
+
+    input_spec = RobustReferenceInputSpec
+    output_spec = RobustReferenceOutputSpec
+
+    def _run_interface(self, runtime):
+        _RobustReference(
+            self.inputs.in_file,
+            n_vols=self.inputs.n_vols,
+            start_vol=self.inputs.start_vol,
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["out_file"] = os.path.abspath(ROBUST_REFERENCE_BASE)
+
+        return outputs
@@ -0,0 +1,194 @@
+from nipype.interfaces.base import (
+    Directory,
+    File,
+    InputMultiObject,
+    SimpleInterface,
+    TraitedSpec,
+    isdefined,
+    traits,
+)
+
+import os
+
+
+def _resampling_cache_key(input_image, reference_image, transforms):
+    """
+    Hash the transform files and both sampling grids
+    """
+    import hashlib
+    import nibabel as nib
+    import numpy as np
+
+    sha = hashlib.sha256()
+    for img_path in [input_image, reference_image]:
+        img = nib.load(img_path)
+        sha.update(np.asarray(img.shape[:3], dtype=np.int64).tobytes())
+        sha.update(np.asarray(img.affine, dtype=np.float64).round(6).tobytes())
+    for xfm in transforms:
+        with open(xfm, "rb") as f:
+            for block in iter(lambda: f.read(1024**2), b""):
+                sha.update(block)
+
+    return sha.hexdigest()
+
+
+def _trilinear_weights(coords, in_shape):
+    """
+    Build the sparse (n_out, n_in) trilinear interpolation operator for
+    voxel `coords` (3, n_out) sampled from a grid of shape `in_shape`.
+    Voxels are indexed in Fortran order; neighbours outside of the input
+    grid contribute zero.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    n_out = coords.shape[1]
+    base = np.floor(coords).astype(np.int64)
+    frac = (coords - base).astype(np.float32)
+    strides = np.array([1, in_shape[0], in_shape[0] * in_shape[1]], dtype=np.int64)
+
+    rows, cols, vals = [], [], []
+    for corner in np.ndindex(2, 2, 2):
+        corner = np.array(corner)[:, None]
+        idx = base + corner
+        weight = np.prod(np.where(corner, frac, 1 - frac), axis=0)
+        valid = np.all((idx >= 0) & (idx < np.array(in_shape[:3])[:, None]), axis=0)
+        valid &= weight > 0
+        rows.append(np.nonzero(valid)[0])
+        cols.append(strides @ idx[:, valid])
+        vals.append(weight[valid])
+
+    return sparse.csr_matrix(
+        (np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+        shape=(n_out, int(np.prod(in_shape[:3]))),
+        dtype=np.float32,
+    )
+
+
+def _get_resampling_operator(input_image, reference_image, transforms, cache_dir=None):
+    """
+    Return the sparse resampling operator mapping `input_image` voxels to
+    `reference_image` voxels through the ants `transforms`, loading it
+    from (or saving it to) `cache_dir` when given
+    """
+    import nibabel as nib
+    import numpy as np
+    from scipy import sparse
+    from oscprep.utils.transforms import apply_ants_transforms, grid_coordinates
+
+    cache_file = None
+    if cache_dir is not None:
+        key = _resampling_cache_key(input_image, reference_image, transforms)
+        cache_file = os.path.join(cache_dir, f"resampling-{key}.npz")
+        if os.path.isfile(cache_file):
+            print(f"Loading cached resampling operator: {cache_file}")
+            return sparse.load_npz(cache_file)
+
+    in_img = nib.load(input_image)
+    ref_img = nib.load(reference_image)
+    ref_ras = (ref_img.affine @ grid_coordinates(ref_img.shape))[:3]
+    in_ras = apply_ants_transforms(ref_ras, transforms)
+    in_vox = np.linalg.inv(in_img.affine) @ np.vstack(
+        [in_ras, np.ones((1, in_ras.shape[1]))]
+    )
+    operator = _trilinear_weights(in_vox[:3], in_img.shape[:3])
+
+    if cache_file is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write-then-rename so concurrent runs never read a partial file
+        tmp_file = f"{cache_file[:-len('.npz')]}.{os.getpid()}.tmp.npz"
+        sparse.save_npz(tmp_file, operator, compressed=False)
+        os.replace(tmp_file, cache_file)
+
+    return operator
+
+
+def _SparseApplyTransforms(
+    input_image,
+    reference_image,
+    transforms,
+    output_image,
+    cache_dir=None,
+    chunk_size=32,
+):
+    """
+    Resample every volume of `input_image` to `reference_image` with one
+    precomputed sparse operator, `chunk_size` volumes at a time
+    """
+    import nibabel as nib
+    import numpy as np
+    from oscprep.utils.nifti_io import Nifti4DWriter
+
+    operator = _get_resampling_operator(
+        input_image, reference_image, transforms, cache_dir=cache_dir
+    )
+
+    in_img = nib.load(input_image)
+    ref_img = nib.load(reference_image)
+    n_vols = in_img.shape[3] if len(in_img.shape) > 3 else 1
+    in_data = np.asarray(in_img.dataobj, dtype=np.float32)
+    in_data = in_data.reshape(-1, n_vols, order="F")
+
+    writer = Nifti4DWriter(
+        output_image,
+        (*ref_img.shape[:3], n_vols),
+        ref_img.affine,
+        header=ref_img.header,
+        repetition_time=in_img.header.get_zooms()[3] if n_vols > 1 else None,
+    )
+    for t0 in range(0, n_vols, chunk_size):
+        out_chunk = operator @ in_data[:, t0 : t0 + chunk_size]
+        for ix in range(out_chunk.shape[1]):
+            writer.write_volume(
+                t0 + ix, out_chunk[:, ix].reshape(ref_img.shape[:3], order="F")
+            )
+    writer.close()
+
+
+class SparseApplyTransformsInputSpec(TraitedSpec):
+    input_image = File(exists=True, desc="4D image to resample", mandatory=True)
+    reference_image = File(exists=True, desc="reference image", mandatory=True)
+    transforms = InputMultiObject(
+        File(exists=True),
+        desc="ants transforms, in antsApplyTransforms order",
+        mandatory=True,
+    )
+    output_image = traits.Str(
+        "resampled.nii.gz", usedefault=True, desc="output image filename"
+    )
+    cache_dir = Directory(
+        desc="directory where resampling operators are cached", nohash=True
+    )
+
+
+class SparseApplyTransformsOutputSpec(TraitedSpec):
+    output_image = File(exists=True, desc="resampled image")
+
+
+class SparseApplyTransforms(SimpleInterface):
+    """
+    Resample a time-series with a sparse (output voxels x input voxels)
+    trilinear operator that is built once per transform and grid pair
+    """
+
+    input_spec = SparseApplyTransformsInputSpec
+    output_spec = SparseApplyTransformsOutputSpec
+
+    def _run_interface(self, runtime):
+        _SparseApplyTransforms(
+            self.inputs.input_image,
+            self.inputs.reference_image,
+            self.inputs.transforms,
+            self.inputs.output_image,
+            cache_dir=(
+                self.inputs.cache_dir if isdefined(self.inputs.cache_dir) else None
+            ),
+        )
+
+        return runtime
+
+    def _list_outputs(self):
+        outputs = self._outputs().get()
+        outputs["output_image"] = os.path.abspath(self.inputs.output_image)
+
+        return outputs
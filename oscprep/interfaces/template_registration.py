@@ -0,0 +1,127 @@
+from nipype.interfaces.base import (
+    Directory,
+    File,
+    SimpleInterface,
+    TraitedSpec,
+    traits,
+)
+
+import os
+
+# RegistrationSynQuick outputs kept in the cache
+TEMPLATE_REG_OUTPUTS = {
+    "out_matrix": "transform0GenericAffine.mat",
+    "forward_warp_field": "transform1Warp.nii.gz",
+    "inverse_warp_field": "transform1InverseWarp.nii.gz",
+    "warped_image": "transformWarped.nii.gz",
+}
+
+
+def _image_hash(img_path):
+    """
+    Hash the voxel data and affine of an image (independent of the
+    compression or header timestamps of the file)
+    """
+    import hashlib
+    import nibabel as nib
+    import numpy as np
+
+    img = nib.load(img_path)
+    sha = hashlib.sha256()
+    sha.update(np.asarray(img.shape, dtype=np.int64).tobytes())
+    sha.update(np.asarray(img.affine, dtype=np.float64).round(6).tobytes())
+    sha.update(np.ascontiguousarray(img.dataobj).tobytes())
+
+    return sha.hexdigest()
+
+
+def _TemplateRegistration(
+    moving_image, fixed_image, template, cache_dir, transform_type="s", n_procs=1
+):
+    """
+    Return the RegistrationSynQuick outputs registering `moving_image` to
+    the `template` image `fixed_image`. Outputs are looked up in (and saved
+    to) `cache_dir`, keyed by the template and the hash of `moving_image`.
+    """
+    import shutil
+    from nipype.interfaces.ants import RegistrationSynQuick
+
+    cache_key = f"tpl-{template}_anat-{_image_hash(moving_image)[:16]}"
+    cache_key += f"_xfm-{transform_type}"
+    cache_path = os.path.abspath(os.path.join(cache_dir, cache_key))
+    cached_outputs = {
+        k: os.path.join(cache_path, v) for k, v in TEMPLATE_REG_OUTPUTS.items()
+    }
+    if all(os.path.isfile(v) for v in cached_outputs.values()):
+        print(f"Using cached template registration: {cache_path}")
+        return cached_outputs
+
+    reg = RegistrationSynQuick(
+        fixed_image=fixed_image,
+        moving_image=moving_image,
+        transform_type=transform_type,
+        num_threads=n_procs,
+        output_prefix="transform",
+    )
+    reg_outputs = reg.run().outputs
+
+    os.makedirs(cache_path, exist_ok=True)
+    for k, cached_output in cached_outputs.items():
+        # copy-then-rename so concurrent invocations never see partial files
+        tmp_output = f"{cached_output}.{os.getpid()}.tmp"
+        shutil.copyfile(getattr(reg_outputs, k), tmp_output)
+        os.replace(tmp_output, cached_output)
+
+    return cached_outputs
+
+
+class TemplateRegistrationInputSpec(TraitedSpec):
+    moving_image = File(exists=True, desc="anatomical image", mandatory=True)
+    fixed_image = File(exists=True, desc="template image", mandatory=True)
+    template = traits.Str(desc="template name", mandatory=True)
+    cache_dir = Directory(
+        desc="directory where template registrations are cached", mandatory=True
+    )
+    transform_type = traits.Enum(
+        "s",
+        "t",
+        "r",
+        "a",
+        "sr",
+        "b",
+        "br",
+        usedefault=True,
+        desc="RegistrationSynQuick transform type",
+    )
+    num_threads = traits.Int(1, usedefault=True, nohash=True, desc="number of threads")
+
+
+class TemplateRegistrationOutputSpec(TraitedSpec):
+    out_matrix = File(exists=True, desc="affine transform")
+    forward_warp_field = File(exists=True, desc="forward warp field")
+    inverse_warp_field = File(exists=True, desc="inverse warp field")
+    warped_image = File(exists=True, desc="anatomical image in template space")
+
+
+class TemplateRegistration(SimpleInterface):
+    """
+    RegistrationSynQuick of an anatomical image to a template, estimated
+    once per anatomical image and template and reused from `cache_dir`
+    """
+
+    input_spec = TemplateRegistrationInputSpec
+    output_spec = TemplateRegistrationOutputSpec
+
+    def _run_interface(self, runtime):
+        self._results.update(
+            _TemplateRegistration(
+                self.inputs.moving_image,
+                self.inputs.fixed_image,
+                self.inputs.template,
+                self.inputs.cache_dir,
+                transform_type=self.inputs.transform_type,
+                n_procs=self.inputs.num_threads,
+            )
+        )
+
+        return runtime
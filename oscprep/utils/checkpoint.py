@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+
+
+class VolumeCheckpoint:
+    """
+    Volume-level checkpoint manifest for interfaces that fill a 4D
+    output one volume at a time.
+
+    The manifest records the checksum of every completed volume along
+    with a `key` describing the inputs. A manifest written for other
+    inputs is discarded.
+    """
+
+    def __init__(self, manifest_path, key):
+        self.manifest_path = manifest_path
+        self.key = key
+        self.volumes = {}
+
+        if os.path.isfile(manifest_path):
+            try:
+                with open(manifest_path) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}
+            if manifest.get("key") == key:
+                self.volumes = manifest.get("volumes", {})
+
+    @staticmethod
+    def checksum(vol_data):
+        return hashlib.sha1(vol_data.tobytes(order="F")).hexdigest()
+
+    def resume_index(self, read_volume, n_vols):
+        """
+        Return the index of the first volume that is not recorded, or
+        whose data (read with `read_volume`) no longer matches its
+        recorded checksum
+        """
+
+        for vol_idx in range(n_vols):
+            recorded = self.volumes.get(str(vol_idx))
+            if recorded is None or recorded != self.checksum(read_volume(vol_idx)):
+                break
+        else:
+            return n_vols
+
+        # Volumes after the resume point are recomputed
+        self.volumes = {k: v for k, v in self.volumes.items() if int(k) < vol_idx}
+
+        return vol_idx
+
+    def record(self, vol_idx, vol_data):
+        self.volumes[str(vol_idx)] = self.checksum(vol_data)
+
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": self.key, "volumes": self.volumes}, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def remove(self):
+        if os.path.isfile(self.manifest_path):
+            os.remove(self.manifest_path)
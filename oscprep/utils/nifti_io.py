@@ -0,0 +1,153 @@
+import gzip
+import os
+import shutil
+
+import nibabel as nib
+import numpy as np
+
+# Header (348 bytes) + empty extension flag (4 bytes)
+NIFTI_VOX_OFFSET = 352
+
+
+class Nifti4DWriter:
+    """
+    Write a 4D NIfTI image volume by volume.
+
+    The voxel array is preallocated as a memory-mapped, uncompressed
+    NIfTI file so only the volume being written is held in memory. The
+    header is finalized (intensity range) on `close`, and the image is
+    gzip-streamed to `out_file` when it ends with `.gz`.
+
+    With `resume=True`, a scratch file left behind by an interrupted
+    writer with the same shape and dtype is reopened instead of being
+    reallocated, so previously written volumes are kept.
+    """
+
+    def __init__(
+        self,
+        out_file,
+        shape,
+        affine,
+        header=None,
+        dtype=np.float32,
+        repetition_time=None,
+        resume=False,
+    ):
+        self.out_file = out_file
+        self.scratch_file = (
+            out_file[: -len(".gz")] if out_file.endswith(".gz") else out_file
+        )
+        self.shape = tuple(shape)
+
+        hdr = (
+            nib.Nifti1Header()
+            if header is None
+            else nib.Nifti1Header.from_header(header)
+        )
+        hdr.set_data_dtype(dtype)
+        hdr.set_data_shape(self.shape)
+        hdr.set_qform(affine, code=1)
+        hdr.set_sform(affine, code=1)
+        hdr.set_xyzt_units("mm", "sec")
+        zooms = np.sqrt(np.sum(np.asarray(affine)[:3, :3] ** 2, axis=0))
+        if len(self.shape) > 3:
+            zooms = (*zooms, repetition_time or 1.0)
+        hdr.set_zooms(zooms)
+        hdr.set_data_offset(NIFTI_VOX_OFFSET)
+        hdr["scl_slope"], hdr["scl_inter"] = np.nan, np.nan
+        self.header = hdr
+
+        n_bytes = int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        self.resumed = (
+            resume
+            and os.path.isfile(self.scratch_file)
+            and os.path.getsize(self.scratch_file) == NIFTI_VOX_OFFSET + n_bytes
+        )
+        if not self.resumed:
+            with open(self.scratch_file, "wb") as f:
+                self._write_header(f)
+                f.truncate(NIFTI_VOX_OFFSET + n_bytes)
+        self.data = np.memmap(
+            self.scratch_file,
+            dtype=hdr.get_data_dtype(),
+            mode="r+",
+            offset=NIFTI_VOX_OFFSET,
+            shape=self.shape,
+            order="F",
+        )
+
+    def _write_header(self, fileobj):
+        fileobj.seek(0)
+        fileobj.write(self.header.binaryblock)
+        fileobj.write(b"\x00" * (NIFTI_VOX_OFFSET - len(self.header.binaryblock)))
+
+    def read_volume(self, vol_idx):
+        return np.asarray(self.data[..., vol_idx])
+
+    def write_volume(self, vol_idx, vol_data):
+        self.data[..., vol_idx] = vol_data
+
+    def write_voxels(self, start, voxel_data):
+        """
+        Write the time-series `voxel_data` (n_voxels, n_tps) of voxels
+        `start` to `start + n_voxels` (Fortran-ordered voxel indices)
+        """
+        voxels = self.data.reshape(-1, self.shape[-1], order="F")
+        voxels[start : start + len(voxel_data)] = voxel_data
+
+    def close(self):
+        self.data.flush()
+        # Intensity range, one volume at a time
+        cal_min, cal_max = np.inf, -np.inf
+        for vol_idx in range(int(np.prod(self.shape[3:]))):
+            vol_data = self.data.reshape(*self.shape[:3], -1, order="F")[..., vol_idx]
+            if vol_data.size:
+                cal_min = min(cal_min, float(np.nanmin(vol_data)))
+                cal_max = max(cal_max, float(np.nanmax(vol_data)))
+        del self.data
+        if np.isfinite(cal_min) and np.isfinite(cal_max):
+            self.header["cal_min"] = cal_min
+            self.header["cal_max"] = cal_max
+        with open(self.scratch_file, "r+b") as f:
+            self._write_header(f)
+
+        if self.scratch_file != self.out_file:
+            with open(self.scratch_file, "rb") as src, gzip.open(
+                self.out_file, "wb", compresslevel=1
+            ) as dst:
+                shutil.copyfileobj(src, dst, length=16 * 1024**2)
+            os.remove(self.scratch_file)
+
+        return self.out_file
+
+
+def open_nifti_memmap(in_file, scratch_dir="."):
+    """
+    Memory-map the voxel array of a NIfTI image (read-only). Gzipped
+    images are first decompressed (streamed) into `scratch_dir`.
+
+    Returns
+    -------
+    img : the nibabel image (header access only)
+    data : the memory-mapped voxel array (raw, unscaled values)
+    scratch_file : the decompressed copy to remove when done, or None
+    """
+
+    scratch_file = None
+    if in_file.endswith(".gz"):
+        scratch_file = os.path.join(
+            scratch_dir, os.path.basename(in_file)[: -len(".gz")]
+        )
+        with gzip.open(in_file, "rb") as src, open(scratch_file, "wb") as dst:
+            shutil.copyfileobj(src, dst, length=16 * 1024**2)
+    img = nib.load(scratch_file or in_file)
+    data = np.memmap(
+        scratch_file or in_file,
+        dtype=img.header.get_data_dtype(),
+        mode="r",
+        offset=int(img.dataobj.offset),
+        shape=img.shape,
+        order="F",
+    )
+
+    return img, data, scratch_file
@@ -0,0 +1,31 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def imap_ordered(func, tasks, n_procs=1, initializer=None, initargs=()):
+    """
+    Apply `func` to every element of `tasks` across a bounded process
+    pool and yield the results in the order of `tasks`.
+
+    At most `2 * n_procs` tasks are in flight at any time, so inputs
+    are not all pickled up front. When `n_procs` is 1, tasks are run
+    serially in the calling process.
+    """
+
+    if n_procs <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for task in tasks:
+            yield func(task)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=n_procs, initializer=initializer, initargs=initargs
+    ) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(func, task))
+            if len(pending) >= 2 * n_procs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
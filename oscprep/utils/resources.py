@@ -0,0 +1,87 @@
+import nibabel as nib
+import numpy as np
+
+# nipype's default `Node` memory estimate
+DEFAULT_MEM_GB = 0.20
+# MNI152NLin6Asym, res-2
+STD_GRID_SHAPE = (91, 109, 91)
+
+
+def estimate_bold_mem_gb(bold_path, anat_path=None, std_shape=STD_GRID_SHAPE):
+    """
+    Estimate the memory (GB) needed to hold a bold series as float32,
+    reading only NIfTI headers.
+
+    Returns
+    -------
+    dict with the size of
+        `volume`: a single native bold volume
+        `native`: the native bold series
+        `t1`: the series resampled to the field-of-view of `anat_path`
+            at bold resolution (`native` if `anat_path` is not given)
+        `std`: the series resampled to a `std_shape` template grid
+    """
+
+    bold_hdr = nib.load(bold_path).header
+    bold_shape = bold_hdr.get_data_shape()
+    bold_zooms = np.array(bold_hdr.get_zooms()[:3], dtype=np.float64)
+    n_vols = bold_shape[3] if len(bold_shape) > 3 else 1
+    vol_gb = 4 / 1024**3
+
+    n_t1_voxels = np.prod(bold_shape[:3])
+    if anat_path is not None:
+        anat_hdr = nib.load(anat_path).header
+        anat_fov = np.array(anat_hdr.get_data_shape()[:3]) * np.array(
+            anat_hdr.get_zooms()[:3]
+        )
+        n_t1_voxels = np.prod(np.ceil(anat_fov / bold_zooms))
+
+    return {
+        "volume": float(np.prod(bold_shape[:3]) * vol_gb),
+        "native": float(np.prod(bold_shape[:3]) * n_vols * vol_gb),
+        "t1": float(n_t1_voxels * n_vols * vol_gb),
+        "std": float(np.prod(std_shape) * n_vols * vol_gb),
+    }
+
+
+def set_workflow_resources(
+    workflow, mem_gb, volume_mem_gb=None, n_procs=None, volume_nodes=()
+):
+    """
+    Assign resource estimates to every node of `workflow` (or to a single
+    node) still using nipype's default estimates. Nodes with explicit
+    estimates are left unchanged.
+
+    - utility (`nipype.interfaces.utility`) and in-process nodes keep the
+      default estimates
+    - MapNodes, whose subnodes each handle a single volume, and nodes
+      named in `volume_nodes` get `volume_mem_gb`
+    - every other node, assumed to load the whole series, gets `mem_gb`,
+      and `n_procs` if its interface is multi-threaded
+    """
+    from nipype.pipeline import engine as pe
+
+    if isinstance(workflow, pe.Node):
+        nodes = [workflow]
+    else:
+        nodes = [workflow.get_node(_name) for _name in workflow.list_node_names()]
+
+    for node in nodes:
+        if node.run_without_submitting or type(node.interface).__module__.startswith(
+            "nipype.interfaces.utility"
+        ):
+            continue
+        if node._mem_gb != DEFAULT_MEM_GB:
+            continue
+        if isinstance(node, pe.MapNode) or node.name in volume_nodes:
+            # `MapNode` copies `mem_gb` and `n_procs` to every subnode
+            if volume_mem_gb is not None:
+                node._mem_gb = max(volume_mem_gb, DEFAULT_MEM_GB)
+            continue
+        node._mem_gb = max(mem_gb, DEFAULT_MEM_GB)
+        if (
+            n_procs is not None
+            and node._n_procs is None
+            and hasattr(node.interface.inputs, "num_threads")
+        ):
+            node.n_procs = n_procs
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+
+def hash_inputs(paths, params=None):
+    """
+    Content-address a computation: sha256 of the bytes of every file in
+    `paths` and of the JSON-serialized `params`
+    """
+
+    sha = hashlib.sha256()
+    for _path in paths:
+        with open(_path, "rb") as f:
+            for block in iter(lambda: f.read(16 * 1024**2), b""):
+                sha.update(block)
+    sha.update(json.dumps(params or {}, sort_keys=True).encode())
+
+    return sha.hexdigest()
+
+
+def _cached_path(cache_dir, key, suffix):
+    return os.path.join(cache_dir, f"{key}{suffix}")
+
+
+def fetch_cached(cache_dir, key, out_file):
+    """
+    Link (or copy) the cached result `key` to `out_file`.
+    Returns False if there is no cached result.
+    """
+
+    suffix = "".join(os.path.basename(out_file).partition(".")[1:])
+    cached = _cached_path(cache_dir, key, suffix)
+    if not os.path.isfile(cached):
+        return False
+    if os.path.lexists(out_file):
+        os.remove(out_file)
+    # a hit refreshes the entry for least-recently-used eviction
+    os.utime(cached)
+    try:
+        os.link(cached, out_file)
+    except OSError:
+        shutil.copyfile(cached, out_file)
+
+    return True
+
+
+def store_cached(cache_dir, key, out_file):
+    """
+    Store `out_file` as the cached result `key`
+    """
+
+    suffix = "".join(os.path.basename(out_file).partition(".")[1:])
+    cached = _cached_path(cache_dir, key, suffix)
+    os.makedirs(cache_dir, exist_ok=True)
+    # copy-then-rename so readers never see a partial file
+    tmp_cached = f"{cached}.{os.getpid()}.tmp"
+    shutil.copyfile(out_file, tmp_cached)
+    os.replace(tmp_cached, cached)
+
+
+def prune_cache(cache_dir, max_gb):
+    """
+    Evict the least recently used results of `cache_dir` until they take
+    up at most `max_gb` GB
+    """
+
+    entries = []
+    for _file in os.listdir(cache_dir):
+        _path = os.path.join(cache_dir, _file)
+        if _file.endswith((".lock", ".tmp")) or not os.path.isfile(_path):
+            continue
+        stat = os.stat(_path)
+        entries.append((stat.st_mtime, stat.st_size, _path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, _path in sorted(entries):
+        if total <= max_gb * 1024**3:
+            break
+        os.remove(_path)
+        total -= size
+
+
+@contextmanager
+def cache_lock(cache_dir, key, timeout=24 * 3600, poll=5):
+    """
+    Hold an exclusive lock on the result `key`, so concurrent nodes
+    computing the same result wait for the first one instead of
+    duplicating the work. The lock is an `flock` on a lock file, released
+    by the kernel if the holding process dies (e.g. on preemption).
+    Raises TimeoutError after waiting `timeout` seconds.
+    """
+    import fcntl
+
+    os.makedirs(cache_dir, exist_ok=True)
+    lock_file = os.path.join(cache_dir, f"{key}.lock")
+    # the lock file is left in place: removing it would let a waiting
+    # process lock an unlinked file while a new one is created
+    fd = os.open(lock_file, os.O_CREAT | os.O_RDWR)
+    try:
+        start = time.time()
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.time() - start > timeout:
+                    raise TimeoutError(f"Timed out waiting for {lock_file}.")
+                time.sleep(poll)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        yield
+    finally:
+        os.close(fd)
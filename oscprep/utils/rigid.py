@@ -0,0 +1,207 @@
+import numpy as np
+from scipy import ndimage
+
+# (sample step in voxels, gaussian smoothing sigma in voxels), coarse to fine
+RIGID_LEVELS = ((4, 2.0), (2, 1.0))
+
+
+def rigid_matrix(params, center):
+    """
+    4x4 matrix of the rigid transform `params` (rx, ry, rz in radians,
+    tx, ty, tz in mm), rotating about `center` (mm):
+        y = Rx Ry Rz (x - center) + center + t
+    """
+
+    rx, ry, rz, tx, ty, tz = params
+    cx, sx = np.cos(rx), np.sin(rx)
+    cy, sy = np.cos(ry), np.sin(ry)
+    cz, sz = np.cos(rz), np.sin(rz)
+    rot_x = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    rot_y = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    rot_z = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    rot = rot_x @ rot_y @ rot_z
+
+    center = np.asarray(center, dtype=np.float64)
+    mat = np.eye(4)
+    mat[:3, :3] = rot
+    mat[:3, 3] = center - rot @ center + np.array([tx, ty, tz])
+
+    return mat
+
+
+def rigid_params(mat, center):
+    """
+    Rigid parameters (rx, ry, rz, tx, ty, tz) of the 4x4 rigid `mat`,
+    inverse of `rigid_matrix`
+    """
+
+    rot = np.asarray(mat)[:3, :3]
+    ry = np.arcsin(np.clip(rot[0, 2], -1, 1))
+    rz = np.arctan2(-rot[0, 1], rot[0, 0])
+    rx = np.arctan2(-rot[1, 2], rot[2, 2])
+    center = np.asarray(center, dtype=np.float64)
+    translation = np.asarray(mat)[:3, 3] - (center - rot @ center)
+
+    return np.array([rx, ry, rz, *translation])
+
+
+def rms_deviation(mat1, mat2, center, radius=80.0):
+    """
+    RMS displacement (mm) between two affines over a sphere of `radius`
+    mm about `center`, as FSL's `rmsdiff` (Jenkinson, 1999)
+    """
+
+    diff = mat1 @ np.linalg.inv(mat2) - np.eye(4)
+    lin, trans = diff[:3, :3], diff[:3, 3] + diff[:3, :3] @ np.asarray(center)
+
+    return float(np.sqrt(0.2 * radius**2 * np.trace(lin.T @ lin) + trans @ trans))
+
+
+class RigidEstimator:
+    """
+    Fast in-process rigid registration of volumes to a fixed `reference`
+    (least squares, Gauss-Newton).
+
+    The reference is sampled once per level, at subsampled voxels of its
+    foreground, and every volume is fitted to these samples
+    coarse-to-fine over `levels` (sample step, smoothing).
+
+    Coordinates are mm coordinates given by `vox_to_mm` (e.g. the FSL
+    scaled voxel coordinates of the grid). Estimated parameters map
+    reference coordinates to volume coordinates (see `rigid_matrix`), so
+    `volume(rigid_matrix(params) @ x) ~ reference(x)`.
+    """
+
+    def __init__(
+        self,
+        reference,
+        vox_to_mm,
+        levels=RIGID_LEVELS,
+        mask_fraction=0.1,
+        max_iter=10,
+        tol=1e-3,
+    ):
+        self.shape = reference.shape[:3]
+        self.vox_to_mm = np.asarray(vox_to_mm, dtype=np.float64)
+        self.mm_to_vox = np.linalg.inv(self.vox_to_mm)
+        self.center = (
+            self.vox_to_mm @ np.array([*((np.array(self.shape) - 1) / 2), 1.0])
+        )[:3]
+        self.max_iter = max_iter
+        self.tol = tol
+
+        reference = np.asarray(reference, dtype=np.float32)
+        threshold = mask_fraction * np.percentile(reference, 98)
+        self.levels = []
+        for step, sigma in levels:
+            smoothed = ndimage.gaussian_filter(reference, sigma)
+            # thin slabs keep at least 4 sampled slices
+            grid = tuple(
+                slice(
+                    min(step, max(dim // 4, 1)) // 2, dim, min(step, max(dim // 4, 1))
+                )
+                for dim in self.shape
+            )
+            sampled = smoothed[grid]
+            foreground = sampled > threshold
+            ijk = np.stack(
+                np.meshgrid(
+                    *[np.arange(dim)[s] for dim, s in zip(self.shape, grid)],
+                    indexing="ij",
+                ),
+                axis=-1,
+            )[foreground]
+            xyz = self.vox_to_mm @ np.vstack([ijk.T, np.ones((1, len(ijk)))])
+            self.levels.append(
+                {
+                    "sigma": sigma,
+                    "xyz": xyz,
+                    "target": sampled[foreground].astype(np.float64),
+                }
+            )
+
+    def _jacobian_mats(self, params, eps=1e-6):
+        """
+        Derivatives of `rigid_matrix` with respect to each parameter
+        (central differences for rotations)
+        """
+
+        mats = []
+        for k in range(3):
+            dp = np.zeros(6)
+            dp[k] = eps
+            mats.append(
+                (
+                    rigid_matrix(params + dp, self.center)
+                    - rigid_matrix(params - dp, self.center)
+                )
+                / (2 * eps)
+            )
+
+        return mats
+
+    def estimate(self, volume, init=None):
+        """
+        Rigid parameters (rx, ry, rz, tx, ty, tz) aligning `volume` to the
+        reference
+        """
+
+        params = np.zeros(6) if init is None else np.array(init, dtype=np.float64)
+        volume = np.asarray(volume, dtype=np.float32)
+        grad_to_mm = self.mm_to_vox[:3, :3]
+        for level in self.levels:
+            smoothed = ndimage.gaussian_filter(volume, level["sigma"])
+            # intensities are sampled with cubic splines: the smoothing of
+            # linear interpolation biases the estimates on sharp images
+            coeffs = ndimage.spline_filter(smoothed, order=3, mode="nearest")
+            grads_vox = np.gradient(smoothed)
+            xyz = level["xyz"]
+            for _ in range(self.max_iter):
+                ijk = (self.mm_to_vox @ rigid_matrix(params, self.center) @ xyz)[:3]
+                # samples moved out of the field of view (e.g. of a slab)
+                # are left out
+                in_fov = np.all(
+                    (ijk >= 0) & (ijk <= np.array(self.shape)[:, None] - 1), axis=0
+                )
+                ijk = ijk[:, in_fov]
+                values = ndimage.map_coordinates(
+                    coeffs, ijk, order=3, mode="nearest", prefilter=False
+                )
+                grads = [
+                    ndimage.map_coordinates(_grad, ijk, order=1, mode="nearest")
+                    for _grad in grads_vox
+                ]
+                grads_mm = np.stack(grads, axis=-1) @ grad_to_mm
+                jacobian = np.empty((len(values), 6))
+                for k, mat in enumerate(self._jacobian_mats(params)):
+                    jacobian[:, k] = np.einsum(
+                        "ij,ji->i", grads_mm, (mat @ xyz[:, in_fov])[:3]
+                    )
+                jacobian[:, 3:] = grads_mm
+                delta = np.linalg.lstsq(
+                    jacobian, level["target"][in_fov] - values, rcond=None
+                )[0]
+                params += delta
+                # rotations (rad) are scaled to mm at a 50 mm radius
+                if np.max(np.abs(delta * [50, 50, 50, 1, 1, 1])) < self.tol:
+                    break
+
+        return params
+
+    def _sample(self, volume, params, xyz, order=1):
+        ijk = (self.mm_to_vox @ rigid_matrix(params, self.center) @ xyz)[:3]
+
+        return ndimage.map_coordinates(volume, ijk, order=order, mode="nearest")
+
+    def resample(self, volume, params, order=1):
+        """
+        Resample `volume` aligned to the reference grid
+        """
+        from oscprep.utils.transforms import grid_coordinates
+
+        xyz = self.vox_to_mm @ grid_coordinates(self.shape)
+        resampled = self._sample(
+            np.asarray(volume, dtype=np.float32), params, xyz, order=order
+        )
+
+        return resampled.reshape(self.shape, order="F")
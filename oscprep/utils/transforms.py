@@ -0,0 +1,197 @@
+import numpy as np
+
+
+def fsl_scaling_matrix(img):
+    """
+    Return the 4x4 matrix mapping voxel indices of `img` to
+    FSL "scaled voxel" (mm) coordinates
+    """
+
+    zooms = np.array(img.header.get_zooms()[:3], dtype=np.float64)
+    scaling = np.diag([*zooms, 1.0])
+    # FSL flips the x-axis of images stored in neurological orientation
+    if np.linalg.det(img.affine[:3, :3]) > 0:
+        flip = np.eye(4)
+        flip[0, 0] = -1
+        flip[0, 3] = img.shape[0] - 1
+        scaling = scaling @ flip
+
+    return scaling
+
+
+def load_fsl_mat(mat_path):
+    """
+    Load a 4x4 FSL affine matrix from a text file
+    """
+
+    return np.loadtxt(mat_path, dtype=np.float64).reshape(4, 4)
+
+
+def grid_coordinates(shape):
+    """
+    Return homogeneous voxel coordinates (4, n_voxels) of a 3D grid,
+    ordered to match a Fortran-ordered flattening of the grid
+    """
+
+    ijk = np.indices(shape[:3], dtype=np.float32).reshape(3, -1, order="F")
+
+    return np.vstack([ijk, np.ones((1, ijk.shape[1]), dtype=np.float32)])
+
+
+def fsl_warp_to_source_mm(warp_img, ref_img):
+    """
+    Convert an FSL warp field (defined on `ref_img`) into the FSL mm
+    coordinates of the warp's input space, for every `ref_img` voxel.
+
+    The warp convention (relative or absolute) is guessed in the same
+    spirit as `applywarp`: absolute warps sit close to the reference
+    coordinates, relative warps sit close to zero.
+
+    Returns
+    -------
+    (3, n_voxels) float32 array, Fortran-ordered over the reference grid
+    """
+
+    ref_mm = (fsl_scaling_matrix(ref_img) @ grid_coordinates(ref_img.shape))[:3]
+    warp = np.asarray(warp_img.dataobj, dtype=np.float32)
+    assert warp.shape[:3] == tuple(ref_img.shape[:3]) and warp.shape[-1] == 3, (
+        f"warp shape {warp.shape} does not match reference grid"
+        f" {ref_img.shape[:3]}."
+    )
+    warp = warp.reshape(-1, 3, order="F").T
+
+    if np.mean(np.abs(warp - ref_mm)) < np.mean(np.abs(warp)):
+        # absolute warp
+        return warp.astype(np.float32)
+
+    return (ref_mm + warp).astype(np.float32)
+
+
+# RAS <-> LPS (ITK/ANTs physical space)
+RAS_TO_LPS = np.diag([-1.0, -1.0, 1.0, 1.0])
+
+
+def load_itk_affine(xfm_path):
+    """
+    Load an ITK/ANTs affine transform (binary `.mat` or text `.txt`) as
+    a 4x4 matrix mapping LPS points of the fixed space to the moving space
+    """
+
+    if xfm_path.endswith(".mat"):
+        from scipy.io import loadmat
+
+        xfm = loadmat(xfm_path)
+        params = [v for k, v in xfm.items() if k.startswith("AffineTransform")]
+        assert len(params) == 1, f"No affine transform parameters in {xfm_path}."
+        params, center = params[0].ravel(), xfm["fixed"].ravel()
+    else:
+        with open(xfm_path) as f:
+            lines = dict(line.strip().split(":", 1) for line in f if ":" in line)
+        params = np.array(lines["Parameters"].split(), dtype=np.float64)
+        center = np.array(lines["FixedParameters"].split(), dtype=np.float64)
+
+    matrix = params[:9].reshape(3, 3)
+    affine = np.eye(4)
+    affine[:3, :3] = matrix
+    affine[:3, 3] = params[9:12] + center - matrix @ center
+
+    return affine
+
+
+def apply_ants_transforms(points, transforms):
+    """
+    Map RAS world points (3, n_points) of an `antsApplyTransforms`
+    reference image to the input image, given `transforms` in the order
+    they are passed to `antsApplyTransforms` (e.g. [warp, affine])
+    """
+    import nibabel as nib
+    from scipy.ndimage import map_coordinates
+
+    lps = RAS_TO_LPS[:3, :3] @ points
+    for xfm in transforms:
+        if xfm.endswith((".nii", ".nii.gz")):
+            field_img = nib.load(xfm)
+            field = np.asarray(field_img.dataobj, dtype=np.float32)
+            field = field.reshape(*field.shape[:3], 3)
+            # displacement field is sampled on its own (fixed) grid
+            ras = RAS_TO_LPS[:3, :3] @ lps
+            vox = np.linalg.inv(field_img.affine) @ np.vstack(
+                [ras, np.ones((1, ras.shape[1]))]
+            )
+            lps = lps + np.stack(
+                [
+                    map_coordinates(
+                        field[..., ax], vox[:3], order=1, mode="constant", cval=0.0
+                    )
+                    for ax in range(3)
+                ]
+            )
+        else:
+            affine = load_itk_affine(xfm)
+            lps = affine[:3, :3] @ lps + affine[:3, 3:]
+
+    return RAS_TO_LPS[:3, :3] @ lps
+
+
+# (N, 4, 4) store of per-volume hmc affines
+HMC_AFFINES_CONVENTION = "fsl"
+
+
+def save_hmc_affines(out_file, affines, **metadata):
+    """
+    Save per-volume hmc affines (N, 4, 4) as a single `.npz` file.
+    Affines follow the FSL convention (volume FSL mm to reference FSL mm),
+    extra `metadata` (e.g. the hmc engine) is stored as strings.
+    """
+
+    affines = np.asarray(affines, dtype=np.float64).reshape(-1, 4, 4)
+    metadata = {key: np.array(str(value)) for key, value in metadata.items()}
+    np.savez_compressed(
+        out_file,
+        affines=affines,
+        convention=np.array(HMC_AFFINES_CONVENTION),
+        n_vols=np.array(len(affines)),
+        **metadata,
+    )
+
+
+def load_hmc_affines(hmc_affines):
+    """
+    Load per-volume hmc affines as a (N, 4, 4) array, either from a
+    `.npz` store (`save_hmc_affines`) or from a list of FSL mat files
+    (one per volume, in volume order)
+    """
+
+    if isinstance(hmc_affines, str):
+        hmc_affines = [hmc_affines]
+    if len(hmc_affines) == 1 and str(hmc_affines[0]).endswith(".npz"):
+        with np.load(hmc_affines[0]) as store:
+            assert str(store["convention"]) == HMC_AFFINES_CONVENTION, (
+                f"unsupported hmc affine convention {store['convention']}"
+                f" in {hmc_affines[0]}."
+            )
+            affines = store["affines"]
+        expected_shape = (len(affines), 4, 4)
+        assert (
+            affines.shape == expected_shape
+        ), f"hmc affines have shape {affines.shape}, expected (N, 4, 4)."
+
+        return affines
+
+    return np.stack([load_fsl_mat(mat_path) for mat_path in hmc_affines])
+
+
+def export_fsl_mats(hmc_affines, out_dir, prefix="MAT_"):
+    """
+    Write per-volume hmc affines as FSL mat files `{out_dir}/{prefix}XXXX`
+    (the MCFLIRT layout), and return their paths in volume order
+    """
+    import os
+
+    os.makedirs(out_dir, exist_ok=True)
+    mat_paths = []
+    for ix, affine in enumerate(load_hmc_affines(hmc_affines)):
+        mat_paths.append(os.path.abspath(os.path.join(out_dir, f"{prefix}{ix:04d}")))
+        np.savetxt(mat_paths[-1], affine, fmt="%.10f")
+
+    return mat_paths
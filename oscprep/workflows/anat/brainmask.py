@@ -3,12 +3,20 @@ from nipype.interfaces import utility as niu
 from nipype.pipeline import engine as pe
 
 
-def init_brainmask_mp2rage_wf(name="skullstrip_mp2rage_wf"):
+def init_brainmask_mp2rage_wf(
+    omp_nthreads=1, denoise_sweep_factors=None, name="skullstrip_mp2rage_wf"
+):
     """
     Skullstrip 7T MP2RAGE image
 
     Parameters
     ----------
+    omp_nthreads
+        number of threads used by mp2rage denoising
+    denoise_sweep_factors
+        list of denoising factors also computed (in the same pass as
+        `denoise_factor`) with background noise metrics, to tune
+        `denoise_factor`
 
     Inputs
     ------
@@ -42,12 +50,33 @@ def init_brainmask_mp2rage_wf(name="skullstrip_mp2rage_wf"):
     )
 
     outputnode = pe.Node(
-        niu.IdentityInterface(["mp2rage_brain", "mp2rage_brainmask"]),
+        niu.IdentityInterface(
+            [
+                "mp2rage_brain",
+                "mp2rage_brainmask",
+                "mp2rage_denoised_sweep",
+                "denoise_sweep_metrics",
+            ]
+        ),
         name="outputnode",
     )
 
     # Denoise MP2RAGE image
-    denoise_mp2rage = pe.Node(Mp2rageDenoise(), name="denoise_mp2rage")
+    denoise_mp2rage = pe.Node(
+        Mp2rageDenoise(num_threads=omp_nthreads),
+        name="denoise_mp2rage",
+        n_procs=omp_nthreads,
+    )
+    if denoise_sweep_factors:
+        denoise_mp2rage.inputs.factors = denoise_sweep_factors
+        # fmt: off
+        workflow.connect([
+            (denoise_mp2rage, outputnode, [
+                ("mp2rage_denoised_sweep", "mp2rage_denoised_sweep"),
+                ("sweep_metrics", "denoise_sweep_metrics"),
+            ]),
+        ])
+        # fmt: on
 
     # Skullstrip MP2RAGE at native resolution
     synthstrip_native = pe.Node(
@@ -5,7 +5,16 @@ from nipype.pipeline import engine as pe
 
 
 def init_bold_ref_wf(
-    bold, split_vol_id=0, pca_denoise=False, name="get_bold_reference_wf"
+    bold,
+    split_vol_id=0,
+    n_ref_vols=1,
+    pca_denoise=False,
+    pca_denoise_method="global",
+    pca_denoise_mask=None,
+    pca_denoise_mem_gb=None,
+    pca_denoise_cache_dir=None,
+    pca_denoise_cache_gb=20.0,
+    name="get_bold_reference_wf",
 ):
     """
     Get the bold reference image corresponding
@@ -13,6 +22,12 @@ def init_bold_ref_wf(
 
     Parameters
     ----------
+    split_vol_id
+        index of the reference volume (or of the first volume of the
+        reference window), when there is no sbref image
+    n_ref_vols
+        if > 1, the reference is the median of `n_ref_vols` rigidly
+        realigned volumes
 
     Inputs
     ------
@@ -48,37 +63,55 @@ def init_bold_ref_wf(
         return workflow
 
     else:
-        from nipype.interfaces.fsl.utils import Split
+        if n_ref_vols > 1:
+            from oscprep.interfaces.robust_reference import RobustReference
 
-        split_bold = pe.Node(
-            Split(dimension="t", out_base_name="split_bold_"),
-            name="split_bold",
-        )
+            extract_boldref = pe.Node(
+                RobustReference(n_vols=n_ref_vols, start_vol=split_vol_id),
+                name="robust_boldref",
+            )
+        else:
+            from oscprep.interfaces.extract_volume import ExtractVolume
+
+            extract_boldref = pe.Node(
+                ExtractVolume(vol_id=split_vol_id), name="extract_boldref"
+            )
 
         if pca_denoise:
             from oscprep.interfaces.pca_denoise import PCADenoise
 
+            # the brainmask is derived from the reference, so any mask
+            # falls back to an intensity mask here
             pca_denoise_bold = pe.Node(
-                PCADenoise(),
+                PCADenoise(
+                    method=pca_denoise_method,
+                    auto_mask=pca_denoise_mask is not None,
+                ),
                 name="pca_denoise",
             )
+            if pca_denoise_cache_dir is not None:
+                pca_denoise_bold.inputs.cache_dir = pca_denoise_cache_dir
+                pca_denoise_bold.inputs.cache_max_gb = pca_denoise_cache_gb
+            if pca_denoise_mem_gb is not None:
+                pca_denoise_bold.inputs.mem_budget_gb = pca_denoise_mem_gb
+                pca_denoise_bold._mem_gb = pca_denoise_mem_gb
             # fmt: off
             workflow.connect([
                 (inputnode, pca_denoise_bold, [("bold", "bold_path")]),
-                (pca_denoise_bold, split_bold, [("mppca_path", "in_file")])
+                (pca_denoise_bold, extract_boldref, [("mppca_path", "in_file")])
             ])
             # fmt: on
 
         else:
             # fmt: off
             workflow.connect([
-                (inputnode, split_bold, [("bold", "in_file")]),
+                (inputnode, extract_boldref, [("bold", "in_file")]),
             ])
             # fmt: on
 
         # fmt: off
         workflow.connect([
-            (split_bold, outputnode, [(("out_files", _get_split_volume, split_vol_id), "boldref")]),
+            (extract_boldref, outputnode, [("out_file", "boldref")]),
         ])
         # fmt: on
 
@@ -87,7 +120,3 @@ def init_bold_ref_wf(
 
 def _get_sbref(bold):
     return bold.replace("_bold.nii.gz", "_sbref.nii.gz")
-
-
-def _get_split_volume(out_files, vol_id):
-    return out_files[vol_id]
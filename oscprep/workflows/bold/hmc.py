@@ -6,9 +6,19 @@ from nipype.interfaces.ants import N4BiasFieldCorrection
 
 def init_bold_hmc_wf(
     low_pass_threshold=0,
+    low_pass_mask=None,
     pca_denoise=False,
+    pca_denoise_method="global",
+    pca_denoise_mask=None,
+    pca_denoise_mem_gb=None,
+    pca_denoise_cache_dir=None,
+    pca_denoise_cache_gb=20.0,
     cost_function="normcorr",
     bold_hmc_n4=False,
+    bold_hmc_n4_mode="volume",
+    hmc_engine="mcflirt",
+    export_fsl_mats=False,
+    omp_nthreads=1,
     name="bold_hmc_wf",
 ):
     from niworkflows.engine.workflows import (
@@ -30,13 +40,16 @@ def init_bold_hmc_wf(
                 "bold_file",
                 "bold_reference",
                 "bold_metadata",
+                "bold_mask",
             ]
         ),
         name="inputnode",
     )
 
     outputnode = pe.Node(
-        niu.IdentityInterface(fields=["fsl_affines", "movpar_file", "rmsd_file"]),
+        niu.IdentityInterface(
+            fields=["hmc_affines", "fsl_affines", "movpar_file", "rmsd_file"]
+        ),
         name="outputnode",
     )
 
@@ -44,10 +57,25 @@ def init_bold_hmc_wf(
     lpboldbuffer = pe.Node(
         niu.IdentityInterface(fields=["bold_file"]), name="boldbuffer"
     )
-    if low_pass_threshold > 0:
+    # in-memory LP-filtering and PCA denoising are fused in a single node
+    # (which low-pass filters every voxel)
+    fuse_conditioning = (
+        low_pass_threshold > 0
+        and low_pass_mask is None
+        and pca_denoise
+        and pca_denoise_mem_gb is None
+    )
+    if low_pass_threshold > 0 and not fuse_conditioning:
         # Low-pass-filter bold data
-        lp_filter_bold = pe.Node(LowPassFilterBold(), name="lp_filter_bold")
+        lp_filter_bold = pe.Node(
+            LowPassFilterBold(auto_mask=low_pass_mask == "intensity"),
+            name="lp_filter_bold",
+        )
         lp_filter_bold.inputs.low_pass_threshold = low_pass_threshold
+        if low_pass_mask == "brainmask":
+            # fmt: off
+            workflow.connect([(inputnode, lp_filter_bold, [("bold_mask", "mask_path")])])
+            # fmt: on
         # fmt: off
         workflow.connect([
             (inputnode, lp_filter_bold, [
@@ -66,13 +94,51 @@ def init_bold_hmc_wf(
     mppcaboldbuffer = pe.Node(
         niu.IdentityInterface(fields=["bold_file"]), name="mppcaboldbuffer"
     )
-    if pca_denoise:
+    if fuse_conditioning:
+        from oscprep.interfaces.condition_bold import ConditionBold
+
+        condition_bold = pe.Node(
+            ConditionBold(
+                low_pass_threshold=low_pass_threshold,
+                method=pca_denoise_method,
+                auto_mask=pca_denoise_mask == "intensity",
+            ),
+            name="condition_bold",
+        )
+        if pca_denoise_mask == "brainmask":
+            # fmt: off
+            workflow.connect([(inputnode, condition_bold, [("bold_mask", "mask_path")])])
+            # fmt: on
+        # fmt: off
+        workflow.connect([
+            (lpboldbuffer, condition_bold, [("bold_file", "bold_path")]),
+            (inputnode, condition_bold, [
+                (("bold_metadata", _get_metadata, "RepetitionTime"), "repetition_time"),
+            ]),
+            (condition_bold, mppcaboldbuffer, [("conditioned_bold_path", "bold_file")]),
+        ])
+        # fmt: on
+    elif pca_denoise:
         from oscprep.interfaces.pca_denoise import PCADenoise
 
         pca_denoise_bold = pe.Node(
-            PCADenoise(),
+            PCADenoise(
+                method=pca_denoise_method,
+                auto_mask=pca_denoise_mask == "intensity",
+            ),
             name="pca_denoise",
         )
+        if pca_denoise_cache_dir is not None:
+            pca_denoise_bold.inputs.cache_dir = pca_denoise_cache_dir
+            pca_denoise_bold.inputs.cache_max_gb = pca_denoise_cache_gb
+        if pca_denoise_mem_gb is not None:
+            # out-of-core pca within a fixed memory budget
+            pca_denoise_bold.inputs.mem_budget_gb = pca_denoise_mem_gb
+            pca_denoise_bold._mem_gb = pca_denoise_mem_gb
+        if pca_denoise_mask == "brainmask":
+            # fmt: off
+            workflow.connect([(inputnode, pca_denoise_bold, [("bold_mask", "mask_path")])])
+            # fmt: on
         # fmt: off
         workflow.connect([
             (lpboldbuffer, pca_denoise_bold, [("bold_file", "bold_path")]),
@@ -86,15 +152,26 @@ def init_bold_hmc_wf(
         ])
 
     # Head-motion correction
-    mcflirt = pe.Node(
-        fsl.MCFLIRT(
-            save_mats=True,
-            save_plots=True,
-            save_rms=True,
-            cost=cost_function,
-        ),
-        name="mcflirt",
-    )
+    if hmc_engine == "native":
+        from oscprep.interfaces.rigid_hmc import RigidHMC
+
+        # in-process rigid registration (least squares), volumes are
+        # estimated in parallel
+        hmc = pe.Node(
+            RigidHMC(num_threads=omp_nthreads),
+            name="rigid_hmc",
+            n_procs=omp_nthreads,
+        )
+    else:
+        hmc = pe.Node(
+            fsl.MCFLIRT(
+                save_mats=True,
+                save_plots=True,
+                save_rms=True,
+                cost=cost_function,
+            ),
+            name="mcflirt",
+        )
     normalize_motion = pe.Node(
         NormalizeMotionParams(format="FSL"), name="normalize_motion"
     )
@@ -102,30 +179,75 @@ def init_bold_hmc_wf(
     if not bold_hmc_n4:
         # fmt: off
         workflow.connect([
-            (mppcaboldbuffer, mcflirt, [("bold_file", "in_file")]),
-            (inputnode, mcflirt, [("bold_reference", "ref_file")]),
+            (mppcaboldbuffer, hmc, [("bold_file", "in_file")]),
+            (inputnode, hmc, [("bold_reference", "ref_file")]),
         ])
         # fmt: on
     else:
-        apply_n4_to_bold = init_apply_n4_to_bold(name="apply_n4_to_bold")
-        n4_boldref = pe.Node(
-            N4BiasFieldCorrection(dimension=3), name="apply_n4_to_boldref"
+        apply_n4_to_bold = init_apply_n4_to_bold(
+            n4_mode=bold_hmc_n4_mode, name="apply_n4_to_bold"
         )
         # fmt: off
         workflow.connect([
             (mppcaboldbuffer, apply_n4_to_bold, [("bold_file", "inputnode.bold")]),
-            (apply_n4_to_bold, mcflirt, [("outputnode.n4_bold", "in_file")]),
-            (inputnode, n4_boldref, [("bold_reference", "input_image")]),
-            (n4_boldref, mcflirt, [("output_image", "ref_file")]),
+            (apply_n4_to_bold, hmc, [("outputnode.n4_bold", "in_file")]),
+        ])
+        # fmt: on
+        if bold_hmc_n4_mode == "reference":
+            # the bias field is estimated on the (n4-corrected) hmc reference
+            # fmt: off
+            workflow.connect([
+                (inputnode, apply_n4_to_bold, [("bold_reference", "inputnode.bold_ref")]),
+                (apply_n4_to_bold, hmc, [("outputnode.n4_ref", "ref_file")]),
+            ])
+            # fmt: on
+        else:
+            n4_boldref = pe.Node(
+                N4BiasFieldCorrection(dimension=3), name="apply_n4_to_boldref"
+            )
+            # fmt: off
+            workflow.connect([
+                (inputnode, n4_boldref, [("bold_reference", "input_image")]),
+                (n4_boldref, hmc, [("output_image", "ref_file")]),
+            ])
+            # fmt: on
+
+    # Per-volume affines travel downstream as a single (N, 4, 4) store,
+    # per-volume FSL mat files (`fsl_affines`) are only exported on request
+    if hmc_engine == "native":
+        # fmt: off
+        workflow.connect([(hmc, outputnode, [("hmc_affines", "hmc_affines")])])
+        # fmt: on
+        if export_fsl_mats:
+            from oscprep.interfaces.hmc_affines import ExportFSLMats
+
+            export_mats = pe.Node(ExportFSLMats(), name="export_fsl_mats")
+            # fmt: off
+            workflow.connect([
+                (hmc, export_mats, [("hmc_affines", "hmc_affines")]),
+                (export_mats, outputnode, [("mat_files", "fsl_affines")]),
+            ])
+            # fmt: on
+    else:
+        from oscprep.interfaces.hmc_affines import HMCAffines
+
+        hmc_affines = pe.Node(HMCAffines(engine="mcflirt"), name="hmc_affines")
+        # fmt: off
+        workflow.connect([
+            (hmc, hmc_affines, [("mat_file", "mat_files")]),
+            (hmc_affines, outputnode, [("hmc_affines", "hmc_affines")]),
         ])
         # fmt: on
+        if export_fsl_mats:
+            # fmt: off
+            workflow.connect([(hmc, outputnode, [("mat_file", "fsl_affines")])])
+            # fmt: on
 
     # fmt: off
     workflow.connect([
-        (mcflirt, normalize_motion, [("par_file", "in_file")]),
-        (mcflirt, outputnode, [
+        (hmc, normalize_motion, [("par_file", "in_file")]),
+        (hmc, outputnode, [
             (("rms_files", _pick_rel), "rmsd_file"),
-            ("mat_file", "fsl_affines"),
         ]),
         (normalize_motion, outputnode, [("out_file", "movpar_file")]),
     ])
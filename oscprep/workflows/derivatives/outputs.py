@@ -15,6 +15,7 @@ def init_anat_brainmask_derivatives_wf(
     t1w_brain_base,
     t1w_brainmask_base,
     out_path_base="brainmask",
+    denoise_sweep=False,
     name="anat_brainmask_derivatives_wf",
 ):
     from niworkflows.interfaces.bids import DerivativesDataSink
@@ -22,7 +23,14 @@ def init_anat_brainmask_derivatives_wf(
     workflow = Workflow(name=name)
 
     inputnode = pe.Node(
-        niu.IdentityInterface(fields=["t1w_brain", "t1w_brainmask"]),
+        niu.IdentityInterface(
+            fields=[
+                "t1w_brain",
+                "t1w_brainmask",
+                "mp2rage_denoised_sweep",
+                "denoise_sweep_metrics",
+            ]
+        ),
         name="inputnode",
     )
 
@@ -72,6 +80,47 @@ def init_anat_brainmask_derivatives_wf(
         ]
     )
 
+    if denoise_sweep:
+        # mp2rage denoised with each factor of the sweep (volume per factor)
+        ds_denoise_sweep = pe.Node(
+            DerivativesDataSink(
+                base_directory=output_dir,
+                out_path_base=out_path_base,
+                desc="denoisesweep",
+                compress=True,
+            ),
+            name="ds_denoise_sweep",
+            run_without_submitting=True,
+        )
+        ds_denoise_sweep.inputs.source_file = f"{output_dir}/{t1w_brain_base}"
+
+        ds_denoise_sweep_metrics = pe.Node(
+            DerivativesDataSink(
+                base_directory=output_dir,
+                out_path_base=out_path_base,
+                desc="denoisesweep",
+                suffix="metrics",
+            ),
+            name="ds_denoise_sweep_metrics",
+            run_without_submitting=True,
+        )
+        ds_denoise_sweep_metrics.inputs.source_file = f"{output_dir}/{t1w_brain_base}"
+
+        workflow.connect(
+            [
+                (
+                    inputnode,
+                    ds_denoise_sweep,
+                    [("mp2rage_denoised_sweep", "in_file")],
+                ),
+                (
+                    inputnode,
+                    ds_denoise_sweep_metrics,
+                    [("denoise_sweep_metrics", "in_file")],
+                ),
+            ]
+        )
+
     return workflow
 
 
@@ -649,6 +698,7 @@ def init_slab_bold_preproc_derivatives_wf(
     slab_bold_to_t1_warp_base,
     workflow_name_base,
     use_fmaps=True,
+    bold_hmc_mats_base=None,
     out_path_base="bold_preproc",
     name=None,
 ):
@@ -679,6 +729,7 @@ def init_slab_bold_preproc_derivatives_wf(
                 "bold_tcompcor",
                 "bold_crownmask",
                 "bold_hmc",
+                "bold_hmc_mats",
                 "bold_sdc_warp",
                 "slab_bold_to_slabref_bold_mat",
                 "slab_bold_to_slabref_bold_svg",
@@ -836,16 +887,16 @@ def init_slab_bold_preproc_derivatives_wf(
     """
     Transformations
     """
+    # hmc affines are saved as a single (N, 4, 4) store
     ds_bold_hmc = pe.Node(
-        interface=Function(
-            input_names=["hmc_list", "save_base"],
-            output_names=[],
-            function=save_slab_bold_hmc,
+        ExportFile(
+            out_file=f"{output_dir}/{out_path_base}/{bold_hmc_base}",
+            check_extension=False,
+            clobber=True,
         ),
         name=f"ds_{workflow_name_base}_hmc",
         run_without_submitting=True,
     )
-    ds_bold_hmc.inputs.save_base = f"{output_dir}/{out_path_base}/{bold_hmc_base}"
 
     ds_slab_to_slabref_mat = pe.Node(
         ExportFile(
@@ -898,7 +949,7 @@ def init_slab_bold_preproc_derivatives_wf(
                 ds_cifti_bold_metadata,
                 [("cifti_bold_metadata", "in_file")],
             ),
-            (inputnode, ds_bold_hmc, [("bold_hmc", "hmc_list")]),
+            (inputnode, ds_bold_hmc, [("bold_hmc", "in_file")]),
             (
                 inputnode,
                 ds_bold_confounds,
@@ -957,6 +1008,31 @@ def init_slab_bold_preproc_derivatives_wf(
         ]
     )
 
+    if bold_hmc_mats_base is not None:
+        # legacy tarball of per-volume FSL mat files
+        ds_bold_hmc_mats = pe.Node(
+            interface=Function(
+                input_names=["hmc_list", "save_base"],
+                output_names=[],
+                function=save_slab_bold_hmc,
+            ),
+            name=f"ds_{workflow_name_base}_hmc_mats",
+            run_without_submitting=True,
+        )
+        ds_bold_hmc_mats.inputs.save_base = (
+            f"{output_dir}/{out_path_base}/{bold_hmc_mats_base}"
+        )
+
+        workflow.connect(
+            [
+                (
+                    inputnode,
+                    ds_bold_hmc_mats,
+                    [("bold_hmc_mats", "hmc_list")],
+                ),
+            ]
+        )
+
     if use_fmaps:
         ds_bold_sdc = pe.Node(
             ExportFile(
@@ -982,29 +1058,39 @@ def init_slab_bold_preproc_derivatives_wf(
 
 
 def save_slab_bold_hmc(hmc_list, save_base):
+    """
+    Stream the per-volume hmc mat files of `hmc_list` into
+    `{save_base}.tar.gz` in a single sequential write, then verify the
+    archive against the digests of its sources before moving it in place
+    """
+    import hashlib
+    import io
     import os
-    from nipype.interfaces.io import ExportFile
-
-    if not os.path.isdir(save_base):
-        os.makedirs(save_base)
-
-    for ix, vol_affine in enumerate(hmc_list):
-        _vol_affine = vol_affine.split("/")[-1]
-        ds_vol_affine = ExportFile(out_file=f"{save_base}/{_vol_affine}")
-        ds_vol_affine.inputs.in_file = vol_affine
-        ds_vol_affine.run()
+    import tarfile
 
     tar_file = f"{save_base}.tar.gz"
-    tar_cmd = " ".join(
-        [
-            "tar",
-            "-czvf",
-            tar_file,
-            "-C",
-            save_base,
-            ".",
-            "--remove-files",
-        ]
-    )
-    os.system(tar_cmd)
-    assert os.path.exists(tar_file)
+    tmp_file = f"{tar_file}.tmp"
+    os.makedirs(os.path.dirname(tar_file), exist_ok=True)
+
+    digests = {}
+    with tarfile.open(tmp_file, "w:gz") as tar:
+        for vol_affine in hmc_list:
+            with open(vol_affine, "rb") as f:
+                content = f.read()
+            # members keep the layout of `tar -C save_base .`
+            info = tarfile.TarInfo(f"./{os.path.basename(vol_affine)}")
+            info.size = len(content)
+            info.mtime = int(os.path.getmtime(vol_affine))
+            assert info.name not in digests, f"duplicate hmc mat {info.name}."
+            digests[info.name] = hashlib.sha256(content).hexdigest()
+            tar.addfile(info, io.BytesIO(content))
+
+    with tarfile.open(tmp_file, "r:gz") as tar:
+        archived = {
+            member.name: hashlib.sha256(tar.extractfile(member).read()).hexdigest()
+            for member in tar.getmembers()
+        }
+    if archived != digests:
+        os.remove(tmp_file)
+        raise OSError(f"{tar_file} does not match its {len(digests)} hmc mats.")
+    os.replace(tmp_file, tar_file)
@@ -142,6 +142,7 @@ def get_slab_bold_preproc_source_files(bold_path):
     bold_tcompcor = f"{sub_id}/{ses_id}/roi/{bold_path.split('/')[-1].replace('part-mag_bold.nii.gz','desc-confound_tCompCor.nii.gz')}"
     bold_crownmask = f"{sub_id}/{ses_id}/roi/{bold_path.split('/')[-1].replace('part-mag_bold.nii.gz','desc-confound_crownmask.nii.gz')}"
     # transforms
+    slab_bold_hmc = f"{sub_id}/{ses_id}/reg/{bold_path.split('/')[-1].replace('part-mag_bold.nii.gz','desc-hmc_xfm.npz')}"
     slab_bold_hmc_mats = f"{sub_id}/{ses_id}/reg/{bold_path.split('/')[-1].replace('part-mag_bold.nii.gz','hmc.mats')}"
     slab_bold_sdc_warp = f"{sub_id}/{ses_id}/reg/{bold_path.split('/')[-1].replace('part-mag_bold.nii.gz','sdc_warp.nii.gz')}"
     slab_bold_to_slabref_bold_mat = f"{sub_id}/{ses_id}/reg/{bold_path.split('/')[-1].replace('part-mag_bold.nii.gz','from-slab_to-slabref_xfm.mat')}"
@@ -165,7 +166,8 @@ def get_slab_bold_preproc_source_files(bold_path):
         "bold_acompcor_wmcsf": bold_acompcor_wmcsf,
         "bold_tcompcor": bold_tcompcor,
         "bold_crownmask": bold_crownmask,
-        "bold_hmc": slab_bold_hmc_mats,
+        "bold_hmc": slab_bold_hmc,
+        "bold_hmc_mats": slab_bold_hmc_mats,
         "bold_sdc_warp": slab_bold_sdc_warp,
         "slab_bold_to_slabref_bold_mat": slab_bold_to_slabref_bold_mat,
         "slab_bold_to_slabref_bold_svg": slab_bold_to_slabref_bold_svg,
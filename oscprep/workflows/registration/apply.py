@@ -166,7 +166,12 @@ def init_apply_fmap_to_bold_wf(
     return workflow
 
 
-def init_apply_bold_to_anat_wf(slab_bold_quick=False, name="apply_bold_to_t1_wf"):
+def init_apply_bold_to_anat_wf(
+    slab_bold_quick=False,
+    resample_engine="native",
+    omp_nthreads=1,
+    name="apply_bold_to_t1_wf",
+):
     from niworkflows.engine.workflows import (
         LiterateWorkflow as Workflow,
     )
@@ -185,7 +190,7 @@ def init_apply_bold_to_anat_wf(slab_bold_quick=False, name="apply_bold_to_t1_wf"
                 "bold_file",
                 "bold_ref",
                 "bold_metadata",
-                "fsl_hmc_affines",
+                "hmc_affines",
                 "bold_to_t1_warp",
                 "t1_resampled",
             ]
@@ -199,8 +204,13 @@ def init_apply_bold_to_anat_wf(slab_bold_quick=False, name="apply_bold_to_t1_wf"
     )
 
     apply_bold_to_t1 = pe.Node(
-        BoldToT1Transform(debug=slab_bold_quick),
+        BoldToT1Transform(
+            debug=slab_bold_quick,
+            engine=resample_engine,
+            num_threads=omp_nthreads,
+        ),
         name="apply_bold_to_t1",
+        n_procs=omp_nthreads,
     )
 
     apply_bold_ref_to_t1 = pe.Node(fsl.ApplyWarp(), name="apply_bold_ref_to_t1")
@@ -220,7 +230,7 @@ def init_apply_bold_to_anat_wf(slab_bold_quick=False, name="apply_bold_to_t1_wf"
                         ),
                         "repetition_time",
                     ),
-                    ("fsl_hmc_affines", "hmc_mats"),
+                    ("hmc_affines", "hmc_mats"),
                     ("bold_to_t1_warp", "bold_to_t1_warp"),
                     ("t1_resampled", "t1_resampled"),
                 ],
@@ -250,6 +260,103 @@ def init_apply_bold_to_anat_wf(slab_bold_quick=False, name="apply_bold_to_t1_wf"
     return workflow
 
 
+def init_apply_bold_fused_wf(
+    metadata,
+    slice_timing_correction=True,
+    slab_bold_quick=False,
+    omp_nthreads=1,
+    name="apply_bold_fused_wf",
+):
+    """
+    Resample raw bold data to t1 space, and to template space once
+    `inputnode.std_reference` and `inputnode.std_transforms` are set,
+    with a single (trilinear) interpolation combining slice-timing, hmc,
+    sdc and registration transforms. The template series is not resampled
+    with LanczosWindowedSinc, unlike the `ApplyTransforms` path.
+
+    Parameters
+    ----------
+
+    Inputs
+    ------
+
+    Outputs
+    -------
+
+    """
+    from niworkflows.engine.workflows import (
+        LiterateWorkflow as Workflow,
+    )
+
+    from oscprep.interfaces.fused_resample import FusedBoldResample
+
+    from nipype.interfaces import fsl
+
+    workflow = Workflow(name=name)
+
+    inputnode = pe.Node(
+        niu.IdentityInterface(
+            fields=[
+                "bold_file",
+                "bold_ref",
+                "hmc_affines",
+                "bold_to_t1_warp",
+                "t1_resampled",
+                "std_reference",
+                "std_transforms",
+            ]
+        ),
+        name="inputnode",
+    )
+
+    outputnode = pe.Node(
+        niu.IdentityInterface(
+            fields=["t1_space_bold", "t1_space_boldref", "std_space_bold"]
+        ),
+        name="outputnode",
+    )
+
+    fused_resample = pe.Node(
+        FusedBoldResample(
+            repetition_time=metadata["RepetitionTime"],
+            slice_encoding_direction=metadata.get("SliceEncodingDirection", "k"),
+            debug=slab_bold_quick,
+            num_threads=omp_nthreads,
+        ),
+        name="fused_resample",
+        n_procs=omp_nthreads,
+    )
+    if slice_timing_correction:
+        fused_resample.inputs.slice_timing = metadata["SliceTiming"]
+
+    apply_bold_ref_to_t1 = pe.Node(fsl.ApplyWarp(), name="apply_bold_ref_to_t1")
+
+    # fmt: off
+    workflow.connect([
+        (inputnode, fused_resample, [
+            ("bold_file", "bold_path"),
+            ("hmc_affines", "hmc_mats"),
+            ("bold_to_t1_warp", "bold_to_t1_warp"),
+            ("t1_resampled", "t1_resampled"),
+            ("std_reference", "std_reference"),
+            ("std_transforms", "std_transforms"),
+        ]),
+        (fused_resample, outputnode, [
+            ("t1_bold_path", "t1_space_bold"),
+            ("std_bold_path", "std_space_bold"),
+        ]),
+        (inputnode, apply_bold_ref_to_t1, [
+            ("bold_ref", "in_file"),
+            ("t1_resampled", "ref_file"),
+            ("bold_to_t1_warp", "field_file"),
+        ]),
+        (apply_bold_ref_to_t1, outputnode, [("out_file", "t1_space_boldref")]),
+    ])
+    # fmt: on
+
+    return workflow
+
+
 def _get_metadata(metadata_dict, _key):
     assert _key in metadata_dict, f"{_key} not found in metadata."
 
@@ -7,18 +7,30 @@ import nipype.pipeline.engine as pe
 import nipype.interfaces.utility as util
 
 
-def init_apply_n4_to_bold(name="apply_n4_to_bold_wf"):
+def init_apply_n4_to_bold(n4_mode="volume", name="apply_n4_to_bold_wf"):
     """
     N4 Bias-field correct each volume in a bold acquisition.
 
     Parameters
     ----------
+    n4_mode
+        `volume`: run N4 on each volume
+        `reference`: estimate the bias field once on `bold_ref` and divide
+            every volume by it
+        `mean`: estimate the bias field once on the temporal mean of the
+            bold series and divide every volume by it
 
     Inputs
     ------
+    bold
+    bold_ref (`reference` mode)
 
     Outputs
     -------
+    n4_bold
+    n4_ref
+        bias field corrected image the field was estimated on
+        (`reference` and `mean` modes)
 
     """
     from niworkflows.engine.workflows import (
@@ -27,23 +39,62 @@ def init_apply_n4_to_bold(name="apply_n4_to_bold_wf"):
 
     workflow = Workflow(name=name)
 
-    inputnode = pe.Node(niu.IdentityInterface(["bold"]), name="inputnode")
-    outputnode = pe.Node(niu.IdentityInterface(["n4_bold"]), name="outputnode")
+    inputnode = pe.Node(niu.IdentityInterface(["bold", "bold_ref"]), name="inputnode")
+    outputnode = pe.Node(
+        niu.IdentityInterface(["n4_bold", "n4_ref"]), name="outputnode"
+    )
+
+    if n4_mode == "volume":
+        split_bold = pe.Node(Split(dimension="t"), name="split_bold")
+        n4_correction = pe.MapNode(
+            N4BiasFieldCorrection(dimension=3),
+            iterfield=["input_image"],
+            name="n4_correction",
+        )
+        merge_bold = pe.Node(Merge(dimension="t"), name="merge_bold")
+
+        # fmt: off
+        workflow.connect([
+            (inputnode, split_bold, [("bold", "in_file")]),
+            (split_bold, n4_correction, [("out_files", "input_image")]),
+            (n4_correction, merge_bold, [("output_image", "in_files")]),
+            (merge_bold, outputnode, [("merged_file", "n4_bold")])
+        ])
+        # fmt: on
+
+        return workflow
 
-    split_bold = pe.Node(Split(dimension="t"), name="split_bold")
-    n4_correction = pe.MapNode(
-        N4BiasFieldCorrection(dimension=3),
-        iterfield=["input_image"],
-        name="n4_correction",
+    from oscprep.interfaces.bias_field import ApplyBiasField
+
+    estimate_bias = pe.Node(
+        N4BiasFieldCorrection(dimension=3, save_bias=True),
+        name="estimate_bias_field",
     )
-    merge_bold = pe.Node(Merge(dimension="t"), name="merge_bold")
+    apply_bias = pe.Node(ApplyBiasField(), name="apply_bias_field")
+
+    if n4_mode == "mean":
+        from nipype.interfaces.fsl import MeanImage
+
+        mean_bold = pe.Node(
+            MeanImage(dimension="T", output_type="NIFTI_GZ"), name="mean_bold"
+        )
+        # fmt: off
+        workflow.connect([
+            (inputnode, mean_bold, [("bold", "in_file")]),
+            (mean_bold, estimate_bias, [("out_file", "input_image")]),
+        ])
+        # fmt: on
+    else:
+        # fmt: off
+        workflow.connect([(inputnode, estimate_bias, [("bold_ref", "input_image")])])
+        # fmt: on
 
     # fmt: off
     workflow.connect([
-        (inputnode, split_bold, [("bold", "in_file")]),
-        (split_bold, n4_correction, [("out_files", "input_image")]),
-        (n4_correction, merge_bold, [("output_image", "in_files")]),
-        (merge_bold, outputnode, [("merged_file", "n4_bold")])
+        (inputnode, apply_bias, [("bold", "bold_path")]),
+        (estimate_bias, apply_bias, [("bias_image", "bias_field")]),
+        (apply_bias, outputnode, [("n4_bold", "n4_bold")]),
+        (estimate_bias, outputnode, [("output_image", "n4_ref")]),
     ])
     # fmt: on
 